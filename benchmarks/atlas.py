@@ -0,0 +1,84 @@
+"""
+Measures what drawing each sprite costs when every sprite is blitted on its
+own, when they're all passed to a single Surface.blits call, and when that
+call draws them from a texture atlas, along with how many distinct surfaces
+the blits read from each way.
+
+With software blitting, a blit costs the same whichever surface it reads
+from, so the atlas isn't expected to draw measurably faster here; what it
+changes is how many surfaces drawing touches. Fails if the atlas doesn't
+cut that down, or draws anything differently.
+
+    python -m benchmarks.atlas
+"""
+import random
+
+import pygame
+
+from .common import init_headless, time_per_call
+
+
+# Each way of drawing is timed this many times, taking turns with the others,
+# and its best time is kept
+TRIALS = 7
+
+
+def run(counts=(100, 1000, 5000), seed=0):
+    display = init_headless()
+    from game.gameobjects import GameGroup, KillFace, Player, Pointer, Sign, Wall
+    from game.graphics import TextureAtlas
+
+    classes = (KillFace, Player, Pointer, Sign, Wall)
+    print('{:>8} {:>16} {:>16} {:>16} {:>16} {:>16} {:>10} {:>10}'.format(
+        'sprites', 'blit (us/spr)', 'blits (us/spr)', 'atlas (us/spr)',
+        'group (us/spr)', 'no atlas (us/spr)', 'sources', 'atlas srcs'
+    ))
+    for count in counts:
+        rng = random.Random(seed)
+        width, height = display.get_size()
+        sprites = [
+            rng.choice(classes)(rng.randrange(-32, width), rng.randrange(-32, height))
+            for _ in range(count)
+        ]
+        atlas = TextureAtlas.from_gameobjects(sprites)
+        plain = [(sprite.image, sprite.rect.topleft) for sprite in sprites]
+        atlased = [atlas.get_blit(image, dest) for image, dest in plain]
+        sources = len({ image for image, _ in plain })
+        atlas_sources = len({ blit[0] for blit in atlased })
+        assert atlas_sources < sources, \
+            "the atlas should cut down the surfaces the blits read from"
+        display.fill((0, 0, 0))
+        display.blits(plain, doreturn=False)
+        plain_pixels = pygame.image.tobytes(display, 'RGB')
+        display.fill((0, 0, 0))
+        display.blits(atlased, doreturn=False)
+        assert pygame.image.tobytes(display, 'RGB') == plain_pixels, \
+            "blitting from the atlas should draw the same as without it"
+
+        def blit_each():
+            for image, dest in plain:
+                display.blit(image, dest)
+
+        group = GameGroup(sprites, spatial_index='renderer')
+        repeat = max(5, 20000 // count)
+
+        def draw_group(atlas):
+            group.atlas = atlas
+            return time_per_call(lambda: group.draw(display), repeat)
+
+        ways_to_draw = [
+            lambda: time_per_call(blit_each, repeat),
+            lambda: time_per_call(lambda: display.blits(plain, doreturn=False), repeat),
+            lambda: time_per_call(lambda: display.blits(atlased, doreturn=False), repeat),
+            lambda: draw_group(atlas),
+            lambda: draw_group(None),
+        ]
+        trials = [[draw() for draw in ways_to_draw] for _ in range(TRIALS)]
+        timings = [min(trial) for trial in zip(*trials)]
+        print('{:>8} {:>16.2f} {:>16.2f} {:>16.2f} {:>16.2f} {:>16.2f} {:>10} {:>10}'.format(
+            count, *(timing / count for timing in timings), sources, atlas_sources
+        ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,99 @@
+"""
+Compares drawing a level's objects with the static objects baked into chunks,
+as the game does, with blitting every object on its own. The camera pans
+across the level as it would in play, so chunks are rendered as they come into
+view. Checks that both draw the same.
+
+    python -m benchmarks.chunks [--counts 1000 10000] [--spacing 96]
+
+The layer draws a screenful of chunks however few objects there are, and
+redraws the baked objects in front of every object that isn't baked, so it
+pays off less the more objects that aren't baked crowd among those that are.
+"""
+import argparse, os, tempfile, time
+
+import pygame
+
+from .common import init_headless
+from .suite import SPACING, generate_level
+
+
+DEFAULT_COUNTS = (1000, 10000)
+DEFAULT_FRAMES = 300
+# How far the camera moves each frame, in pixels
+PAN_SPEED = (4, 2)
+
+
+def load_groups(path):
+    """Returns the groups of a level, along with a group of the same objects
+    drawn without a static layer."""
+    from game.engine import GameObjectGroups
+    from game.gameobjects import GameGroup
+    from game.graphics import TextureAtlas
+    from game.levels import Level
+
+    groups = GameObjectGroups.from_level(Level.load_from_file(path, use_cache=False))
+    unbaked = GameGroup(spatial_index='renderer')
+    unbaked.add(*groups.all_objects.sprites())
+    unbaked.atlas = TextureAtlas.from_gameobjects(unbaked)
+    return groups.all_objects, unbaked
+
+
+def time_frames(group, display, start, frames):
+    """Draws frames of the camera panning from start, as a full redraw does.
+    Returns the mean microseconds per frame and the last frame's pixels."""
+    from game import constants
+    from game.gameobjects import Vector
+
+    group.offset = Vector(*start)
+    elapsed = 0
+    for _ in range(frames):
+        group.scroll(*PAN_SPEED)
+        begin = time.perf_counter()
+        if not group.draws_background():
+            display.fill(constants.BACKGROUND_COLOR)
+        group.draw(display)
+        elapsed += time.perf_counter() - begin
+    return elapsed * 1e6 / frames, pygame.image.tobytes(display, 'RGB')
+
+
+def measure(name, path, display, frames):
+    from game.gameobjects import Player
+
+    baked, unbaked = load_groups(path)
+    # The camera passes over the player halfway through
+    player = next(sprite for sprite in baked if isinstance(sprite, Player))
+    start = (
+        player.rect.centerx - display.get_width() // 2 - PAN_SPEED[0] * frames // 2,
+        player.rect.centery - display.get_height() // 2 - PAN_SPEED[1] * frames // 2
+    )
+    unbaked_time, unbaked_pixels = time_frames(unbaked, display, start, frames)
+    baked_time, baked_pixels = time_frames(baked, display, start, frames)
+    assert baked_pixels == unbaked_pixels, "chunks should draw the same as the objects"
+    print('{:<16} {:>8} {:>8} {:>14.1f} {:>14.1f} {:>8.2f}x'.format(
+        name, len(unbaked), len(baked.static_layer),
+        unbaked_time, baked_time, unbaked_time / baked_time
+    ))
+
+
+def run(counts=DEFAULT_COUNTS, frames=DEFAULT_FRAMES, spacing=SPACING):
+    display = init_headless()
+    print('{:<16} {:>8} {:>8} {:>14} {:>14} {:>9}'.format(
+        'level', 'objects', 'baked', 'objects (us)', 'chunks (us)', 'gain'
+    ))
+    measure('test.json', 'test.json', display, frames)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for count in counts:
+            path = os.path.join(tmpdir, 'level_{}.json'.format(count))
+            generate_level(path, count, spacing=spacing)
+            measure('generated', path, display, frames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=DEFAULT_COUNTS)
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES)
+    parser.add_argument('--spacing', type=int, default=SPACING,
+        help='average space around each generated object, in pixels')
+    arguments = parser.parse_args()
+    run(arguments.counts, arguments.frames, arguments.spacing)
@@ -0,0 +1,82 @@
+"""
+Measures what the player's collision and interaction checks cost per frame as
+the number of objects in the level grows.
+
+    python -m benchmarks.collision
+"""
+import math, random
+
+from .common import init_headless, time_per_call
+
+
+def scatter(klass, count, spacing, rng):
+    """Spreads objects over a square area whose size grows with the count,
+    so that the density around the player stays constant."""
+    side = int(math.sqrt(count)) + 1
+    return [
+        klass(rng.randrange(side * spacing), rng.randrange(side * spacing))
+        for _ in range(count)
+    ]
+
+
+class LinearGroup():
+    """Tests every sprite for collisions, like a group without a spatial
+    index would."""
+
+    def __init__(self, sprites, rect_name):
+        self.sprites = sprites
+        self.rect_name = rect_name
+
+    def collide(self, rect):
+        return [
+            sprite for sprite in self.sprites
+            if sprite.get_world_rect(self.rect_name).colliderect(rect)
+        ]
+
+    def get_indexed_rect(self, sprite):
+        return sprite.get_world_rect(self.rect_name)
+
+
+def run(counts=(100, 1000, 10000, 50000), seed=0):
+    init_headless()
+    from game.gameobjects import GameGroup, Player, Sign, Wall
+    from game.profiling import profiler
+
+    print('{:>8} {:>14} {:>14} {:>10}'.format(
+        'objects', 'indexed (us)', 'linear (us)', 'tested'
+    ))
+    for count in counts:
+        rng = random.Random(seed)
+        walls = scatter(Wall, count, 160, rng)
+        signs = scatter(Sign, max(1, count // 10), 480, rng)
+        indexed_obstacles = GameGroup(walls, spatial_index='collider')
+        indexed_interactables = GameGroup(signs, spatial_index='base')
+        linear_obstacles = LinearGroup(walls, 'collider')
+        linear_interactables = LinearGroup(signs, 'base')
+        player = Player(0, 0)
+        # The player starts each frame on top of the wall nearest the middle
+        # of the level, so there are always collisions to resolve
+        middle = (int(math.sqrt(count)) + 1) * 160 / 2
+        start = min(
+            walls, key=lambda wall: abs(wall.origin[0] - middle) + abs(wall.origin[1] - middle)
+        ).origin
+
+        def frame(obstacles, interactables):
+            player.move_origin_to(*start)
+            player.collide_with(obstacles)
+            player.last_chatted = -player.chat_cooldown
+            player.check_for_interactions(interactables, 0)
+
+        indexed = time_per_call(lambda: frame(indexed_obstacles, indexed_interactables))
+        linear = time_per_call(lambda: frame(linear_obstacles, linear_interactables), repeat=20)
+        profiler.enabled = True
+        frame(indexed_obstacles, indexed_interactables)
+        profiler.enabled = False
+        tested = profiler.frame_counts['collision_tests']
+        profiler.clear()
+        assert tested > 0, "the player should be tested against the walls around it"
+        print('{:>8} {:>14.1f} {:>14.1f} {:>10}'.format(count, indexed, linear, tested))
+
+
+if __name__ == '__main__':
+    run()
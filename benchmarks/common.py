@@ -0,0 +1,19 @@
+import os, time
+
+import pygame
+
+
+def init_headless(screen_size=(512, 288)):
+    """Sets pygame up to run without a window or an audio device."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.init()
+    return pygame.display.set_mode(screen_size)
+
+
+def time_per_call(func, repeat=200):
+    """Returns the mean number of microseconds a call to func takes."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1e6 / repeat
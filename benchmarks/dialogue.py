@@ -0,0 +1,59 @@
+"""
+Checks that the number of pages built from a dialogue file grows linearly
+with the size of the file, even when choices are nested deeply, and measures
+how long parsing takes.
+
+    python -m benchmarks.dialogue
+"""
+import os, tempfile, time
+
+from .common import init_headless
+
+
+def nested_choices_document(depth, choices_per_page=3):
+    """Returns a dialogue where each page offers several choices which all
+    lead on to the same, deeper page."""
+    page = '<Page>The end.</Page>'
+    for level in range(depth):
+        choices = ''.join(
+            '<Choice>Option {}</Choice>'.format(i) for i in range(choices_per_page)
+        )
+        page = '<Page>Question {}{}{}</Page>'.format(level, choices, page)
+    return '<DialogBox>{}</DialogBox>'.format(page)
+
+
+def count_pages(pages):
+    """Counts the distinct pages reachable from a list of pages."""
+    seen = set()
+    to_visit = list(pages)
+    while to_visit:
+        page = to_visit.pop()
+        if id(page) in seen:
+            continue
+        seen.add(id(page))
+        for choice_pages in page.choices.values():
+            to_visit.extend(choice_pages)
+    return len(seen)
+
+
+def run(depths=(1, 2, 4, 8, 16, 32)):
+    init_headless()
+    from game.graphics import TextBox
+
+    print('{:>6} {:>12} {:>8} {:>12}'.format('depth', 'page nodes', 'pages', 'parse (ms)'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for depth in depths:
+            path = os.path.join(tmpdir, 'dialogue_{}.xml'.format(depth))
+            with open(path, 'w') as dialoguefile:
+                dialoguefile.write(nested_choices_document(depth))
+            start = time.perf_counter()
+            textbox = TextBox(pagefile=path)
+            elapsed = time.perf_counter() - start
+            page_nodes = depth + 1
+            pages = count_pages(textbox.pages)
+            print('{:>6} {:>12} {:>8} {:>12.2f}'.format(depth, page_nodes, pages, elapsed * 1000))
+            assert pages == page_nodes, "page count should match the document"
+
+
+if __name__ == '__main__':
+    run()
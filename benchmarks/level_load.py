@@ -0,0 +1,83 @@
+"""
+Measures how long loading a level takes, and how much memory it allocates,
+for levels made up of increasing numbers of signs, and compares loading
+large levels from JSON against loading them from their compiled form.
+
+    python -m benchmarks.level_load
+"""
+import json, os, resource, tempfile, time, tracemalloc
+
+from .common import init_headless
+
+
+def write_level(path, count, klass='Sign', spacing=96):
+    columns = max(1, int(count ** 0.5))
+    gameobjects = [{ 'class': 'Player', 'location': [0, 0] }]
+    for i in range(count):
+        location = [(i % columns) * spacing, (i // columns) * spacing]
+        gameobjects.append({ 'class': klass, 'location': location })
+    with open(path, 'w') as levelfile:
+        json.dump({ 'gameobjects': gameobjects }, levelfile)
+
+
+def measure_load(path, use_cache=True):
+    """Returns the seconds it took to load the level and the peak number of
+    bytes allocated while doing so. Memory is traced on a second load, since
+    tracing slows loading down considerably."""
+    from game.levels import CompiledLevel, Level
+    cache_existed = os.path.exists(path + CompiledLevel.EXTENSION)
+    start = time.perf_counter()
+    level = Level.load_from_file(path, use_cache=use_cache)
+    elapsed = time.perf_counter() - start
+    if use_cache and not cache_existed:
+        # Trace a cold load again, rather than one from the cache just written
+        os.remove(path + CompiledLevel.EXTENSION)
+    tracemalloc.start()
+    Level.load_from_file(path, use_cache=use_cache)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, level
+
+
+def run(counts=(10, 100, 500), klass='Sign'):
+    init_headless()
+    print('{:>8} {:>12} {:>14} {:>12}'.format(
+        'objects', 'load (ms)', 'peak (KiB)', 'RSS (MiB)'
+    ))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for count in counts:
+            path = os.path.join(tmpdir, 'level_{}.json'.format(count))
+            write_level(path, count, klass)
+            elapsed, peak, level = measure_load(path)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print('{:>8} {:>12.1f} {:>14.0f} {:>12.1f}'.format(
+                count, elapsed * 1000, peak / 1024, rss
+            ))
+
+
+def compare_formats(counts=(1000, 10000, 50000), klass='Wall'):
+    init_headless()
+    print('{:>8} {:>22} {:>22} {:>22}'.format(
+        'objects', 'JSON ms / peak KiB', 'compile ms / peak KiB',
+        'compiled ms / peak KiB'
+    ))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for count in counts:
+            path = os.path.join(tmpdir, 'level_{}.json'.format(count))
+            write_level(path, count, klass)
+            results = [
+                measure_load(path, use_cache=False),
+                # The first cached load compiles the level and writes the cache
+                measure_load(path),
+                measure_load(path),
+            ]
+            print('{:>8} '.format(count) + ' '.join(
+                '{:>22}'.format('{:.1f} / {:.0f}'.format(elapsed * 1000, peak / 1024))
+                for elapsed, peak, level in results
+            ))
+
+
+if __name__ == '__main__':
+    run()
+    print()
+    compare_formats()
@@ -0,0 +1,58 @@
+"""
+Compares loading each object class's spritesheet by decoding its PNG and
+converting it, as the game does without baked assets, with mapping its baked
+pixels into memory. Checks that both draw the same.
+
+    python -m benchmarks.spritesheets
+"""
+import os, shutil, tempfile
+
+import pygame
+
+from .common import init_headless, time_per_call
+
+
+def spritesheet_paths():
+    from game.gameobjects import GameObject
+    paths = set()
+    classes = [GameObject]
+    for klass in classes:
+        classes.extend(klass.__subclasses__())
+        if type(vars(klass).get('spritesheet')) == str:
+            paths.add(klass.spritesheet)
+    return sorted(paths)
+
+
+def draw(image, background=(40, 80, 120)):
+    """Returns the pixels of the image drawn over a background. Fully
+    transparent pixels don't show, whatever their color."""
+    surface = pygame.Surface(image.get_size())
+    surface.fill(background)
+    surface.blit(image, (0, 0))
+    return pygame.image.tobytes(surface, 'RGB')
+
+
+def run(repeat=50):
+    init_headless()
+    from game.graphics import BakedImage, load_image
+
+    print('{:<28} {:>10} {:>14} {:>12}'.format('spritesheet', 'size', 'decode (us)', 'mapped (us)'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for source in spritesheet_paths():
+            # Baked into a copy, so the benchmark leaves the assets as they are
+            path = os.path.join(tmpdir, os.path.basename(source))
+            shutil.copy2(source, path)
+            BakedImage.bake(path)
+
+            decoded = pygame.image.load(path).convert_alpha()
+            mapped = load_image(path)
+            assert draw(decoded) == draw(mapped), "baked pixels should match the image file"
+            print('{:<28} {:>10} {:>14.1f} {:>12.1f}'.format(
+                os.path.basename(path), '{}x{}'.format(*decoded.get_size()),
+                time_per_call(lambda: pygame.image.load(path).convert_alpha(), repeat),
+                time_per_call(lambda: load_image(path), repeat)
+            ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,80 @@
+"""
+Measures how long the game takes to start: from launching the process to the
+first frame on screen, and to the starting level being ready to play. Each
+run is made in a fresh interpreter, so imports are measured cold.
+
+    python -m benchmarks.startup [--runs 5]
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+
+DEFAULT_RUNS = 5
+MEASUREMENTS = ('import_ms', 'first_frame_ms', 'ready_ms', 'launch_to_first_frame_ms')
+
+
+def measure_startup(launched_at):
+    """Starts the game and steps it until the starting level is in. Returns
+    the times, in milliseconds, since the game started being imported, and
+    since launched_at on the wall clock."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    start = time.perf_counter()
+    import pygame
+    pygame.init()
+    from game.constants import GameModes
+    from game.engine import GameState
+    imported = time.perf_counter()
+
+    first_frame = []
+    flip = pygame.display.flip
+
+    def timed_flip():
+        if not first_frame:
+            first_frame.append((time.perf_counter(), time.time()))
+        flip()
+
+    pygame.display.flip = timed_flip
+    gamestate = GameState()
+    while gamestate.mode == GameModes.LOADING:
+        gamestate.step()
+    ready = time.perf_counter()
+    return {
+        'import_ms': (imported - start) * 1000,
+        'first_frame_ms': (first_frame[0][0] - start) * 1000,
+        'ready_ms': (ready - start) * 1000,
+        'launch_to_first_frame_ms': (first_frame[0][1] - launched_at) * 1000,
+    }
+
+
+def measure_startup_in_subprocess():
+    environment = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    launched_at = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', repr(launched_at)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=environment
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(runs=DEFAULT_RUNS):
+    results = [measure_startup_in_subprocess() for _ in range(runs)]
+    print('{:>26} {:>10} {:>10} {:>10}'.format('', 'median', 'min', 'max'))
+    for measurement in MEASUREMENTS:
+        samples = [result[measurement] for result in results]
+        print('{:>26} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            measurement, statistics.median(samples), min(samples), max(samples)
+        ))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    # Used by run to measure each start in a process of its own
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.child is not None:
+        print(json.dumps(measure_startup(arguments.child)))
+    else:
+        run(arguments.runs)
@@ -0,0 +1,258 @@
+"""
+Runs the game headless on generated levels of increasing size, driving it
+with scripted input and a fixed frame time, and reports how long each part of
+a step takes, how long the level took to load and how much memory the process
+holds. Results are written as JSON, so runs on different commits can be
+compared.
+
+    python -m benchmarks.suite [--counts 10 1000 100000] [--output results.json]
+
+Each level is measured in a fresh process, so that memory figures of one
+level aren't inflated by the ones measured before it.
+"""
+import argparse, json, os, platform, random, resource, subprocess, sys
+import tempfile, time
+
+from .common import init_headless
+
+
+DEFAULT_COUNTS = (10, 100, 1000, 10000, 100000)
+DEFAULT_FRAMES = 300
+# Milliseconds per frame, so that every run steps through the same game time
+FRAME_TIME = 33
+# How often each class appears in generated levels
+CLASS_WEIGHTS = { 'Wall': 5, 'Sign': 2, 'KillFace': 2, 'Pointer': 1 }
+# Average space around each object, in pixels
+SPACING = 96
+# The movement key held down, and for how many frames, repeated in a loop
+INPUT_SCRIPT = (('right', 45), ('down', 30), (None, 15), ('left', 45), ('up', 30))
+PHASES = ('process_events', 'update', 'camera', 'draw')
+PERCENTILES = (50, 90, 99)
+
+
+def generate_level(path, count, seed=0, spacing=SPACING):
+    """Writes a level with count objects scattered over a square area that
+    grows with the count, with the player in its middle."""
+    rng = random.Random(seed)
+    side = int((count ** 0.5) * spacing) + spacing
+    names = sorted(CLASS_WEIGHTS)
+    weights = [CLASS_WEIGHTS[name] for name in names]
+    gameobjects = [{ 'class': 'Player', 'location': [side // 2, side // 2] }]
+    for name in rng.choices(names, weights, k=count):
+        gameobjects.append({
+            'class': name,
+            'location': [rng.randrange(side), rng.randrange(side)]
+        })
+    with open(path, 'w') as levelfile:
+        json.dump({ 'gameobjects': gameobjects }, levelfile)
+
+
+def get_rss():
+    """Returns the resident set size of the process in bytes, or its peak if
+    the current size can't be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return get_peak_rss()
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes everywhere but on macOS, where it's in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return peak
+    return peak * 1024
+
+
+def summarize(samples):
+    """Returns percentiles, the mean and the maximum of a list of seconds, in
+    milliseconds."""
+    ordered = sorted(samples)
+    summary = {
+        'p{}'.format(percentile): ordered[
+            min(len(ordered) - 1, (len(ordered) * percentile) // 100)
+        ] * 1000
+        for percentile in PERCENTILES
+    }
+    summary['mean'] = sum(ordered) / len(ordered) * 1000
+    summary['max'] = ordered[-1] * 1000
+    return summary
+
+
+class ScriptedKeys():
+    """Stands in for pygame.key.get_pressed, with only the given keys held."""
+
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+def make_gamestate_class():
+    """Returns a GameState that runs on scripted input and a fixed frame time,
+    and times each phase of its steps."""
+    from game.engine import GameState
+    from game.gameobjects import Player
+
+    class ScriptedGameState(GameState):
+
+        def __init__(self, *args, **kwargs):
+            self.frame = 0
+            self.timings = { phase: [] for phase in PHASES }
+            super().__init__(*args, **kwargs)
+
+        def tick(self):
+            self.frame += 1
+            return FRAME_TIME
+
+        def read_pressed_keys(self):
+            script_length = sum(frames for _, frames in INPUT_SCRIPT)
+            frame = self.frame % script_length
+            held = None
+            for control, frames in INPUT_SCRIPT:
+                if frame < frames:
+                    held = control
+                    break
+                frame -= frames
+            if held is None:
+                return ScriptedKeys(set())
+            return ScriptedKeys({ Player.CONTROLS[held] })
+
+        def timed(self, phase, method, *args):
+            start = time.perf_counter()
+            result = method(*args)
+            self.timings[phase].append(time.perf_counter() - start)
+            return result
+
+        def process_events(self):
+            return self.timed('process_events', super().process_events)
+
+        def update_objects(self):
+            return self.timed('update', super().update_objects)
+
+        def adjust_camera_for_player(self):
+            return self.timed('camera', super().adjust_camera_for_player)
+
+        def draw(self):
+            return self.timed('draw', super().draw)
+
+    return ScriptedGameState
+
+
+def measure_level(count, frames=DEFAULT_FRAMES, seed=0):
+    """Loads a generated level of count objects and steps through it. Returns
+    the measurements as a dict."""
+    init_headless()
+    from game.levels import Level
+
+    gamestate = make_gamestate_class()()
+    # The starting level would otherwise be loading in the background while
+    # the level being measured is
+    gamestate.finish_loading()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'level_{}.json'.format(count))
+        generate_level(path, count, seed)
+        start = time.perf_counter()
+        level = Level.load_from_file(path)
+        gamestate.load_level(level)
+        load_time = time.perf_counter() - start
+    del level
+    rss_after_load = get_rss()
+
+    for phase in PHASES:
+        gamestate.timings[phase].clear()
+    frame_times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        gamestate.step()
+        frame_times.append(time.perf_counter() - start)
+
+    import pygame
+    return {
+        'pygame': pygame.version.ver,
+        'objects': count,
+        'dynamic_objects': len(gamestate.dynamic_objects),
+        'frames': frames,
+        'load_ms': load_time * 1000,
+        'rss_after_load_bytes': rss_after_load,
+        'rss_bytes': get_rss(),
+        'peak_rss_bytes': get_peak_rss(),
+        'frame_ms': summarize(frame_times),
+        'phase_ms': {
+            phase: summarize(samples)
+            for phase, samples in gamestate.timings.items()
+        },
+        'player_rect': list(gamestate.player.rect),
+    }
+
+
+def get_commit():
+    """Returns the commit the benchmarked code is at, if it's a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_level_in_subprocess(count, frames, seed):
+    """Runs measure_level in a fresh interpreter and returns its results."""
+    environment = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.check_output(
+        [
+            sys.executable, '-m', 'benchmarks.suite', '--level', str(count),
+            '--frames', str(frames), '--seed', str(seed)
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=environment
+    )
+    # The results are the last line printed, after anything the game printed
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(counts=DEFAULT_COUNTS, frames=DEFAULT_FRAMES, seed=0, output=None):
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'frame_time_ms': FRAME_TIME,
+        'seed': seed,
+        'levels': [],
+    }
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'objects', 'load (ms)', 'RSS (MiB)', 'p50 (ms)', 'p99 (ms)',
+        'events', 'update', 'draw'
+    ))
+    for count in counts:
+        result = measure_level_in_subprocess(count, frames, seed)
+        results['levels'].append(result)
+        phases = result['phase_ms']
+        print('{:>8} {:>10.1f} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            count, result['load_ms'], result['rss_bytes'] / 2 ** 20,
+            result['frame_ms']['p50'], result['frame_ms']['p99'],
+            phases['process_events']['p50'], phases['update']['p50'],
+            phases['draw']['p50']
+        ))
+    if output:
+        with open(output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=DEFAULT_COUNTS)
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    # Used by run to measure each level in a process of its own
+    parser.add_argument('--level', type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.level is not None:
+        print(json.dumps(measure_level(arguments.level, arguments.frames, arguments.seed)))
+    else:
+        run(arguments.counts, arguments.frames, arguments.seed, arguments.output)
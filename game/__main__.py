@@ -1,16 +1,46 @@
-import pygame
+import argparse, pygame, time
 
 from .engine import GameState
+from .replay import InputRecording
 
 
-def main():
+def main(arguments):
     pygame.init()
-    gamestate = GameState()
-    while True:
-        gamestate.step()
+    gamestate = GameState(profiling=arguments.profile)
+    if arguments.replay:
+        recording = InputRecording.load(arguments.replay)
+        start = time.perf_counter()
+        gamestate.replay(recording, render=not arguments.no_render)
+        print('Replayed {} steps, {:.1f} s of game time, in {:.1f} s'.format(
+            len(recording), recording.get_duration() / 1000,
+            time.perf_counter() - start
+        ))
+        if arguments.profile:
+            gamestate.export_trace()
+        return
+    if arguments.record:
+        gamestate.start_recording()
+    try:
+        while True:
+            gamestate.step()
+    finally:
+        if arguments.record:
+            gamestate.stop_recording().save(arguments.record)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m game')
+    parser.add_argument('--record', metavar='PATH', help="record the session's input to a file")
+    parser.add_argument('--replay', metavar='PATH', help="play back recorded input, then exit")
+    parser.add_argument(
+        '--no-render', action='store_true',
+        help="don't draw while replaying, to replay faster than real time"
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="profile every step, list any images that are slow to draw, and "
+             "write a trace after a replay"
+    )
     try:
-        main()
+        main(parser.parse_args())
     except KeyboardInterrupt:
         pass
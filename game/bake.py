@@ -0,0 +1,142 @@
+"""
+Bakes the game's assets ahead of time, spread over a pool of processes:
+images into raw pixels, dialogue into page graphs and levels into their
+compiled form, each written next to the file it comes from. The game loads
+baked assets in place of the originals for as long as they're up to date.
+
+    python -m game.bake [--jobs N] [--force] [directory ...]
+
+An asset that fails to bake is reported without stopping the others, and
+makes the command exit with a non-zero status.
+"""
+import argparse, json, os, sys, time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from . import constants
+from .gameobjects import GameObject
+from .graphics import BakedImage, DialogueGraph, LazyImage
+from .levels import CompiledLevel
+
+
+# What each kind of asset is baked with, and the file extensions it's found
+# by. JSON files are only levels if they look like one.
+BAKERS = {
+    'image': BakedImage,
+    'dialogue': DialogueGraph,
+    'level': CompiledLevel,
+}
+EXTENSIONS = {
+    '.png': 'image',
+    '.xml': 'dialogue',
+    '.json': 'level',
+}
+
+
+def is_level_file(path):
+    """Whether a JSON file holds a level, which is an object with a list of
+    gameobjects. Files that can't be parsed count as levels, so that the
+    error is reported when they're baked rather than the file skipped."""
+    try:
+        with open(path, 'r') as jsonfile:
+            data = json.load(jsonfile)
+    except (OSError, ValueError):
+        return True
+    return isinstance(data, dict) and isinstance(data.get('gameobjects'), list)
+
+
+def find_assets(directories):
+    """Returns (kind, path) pairs for the assets in the directories, and
+    those the object classes use from anywhere else."""
+    assets = dict()
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                path = os.path.realpath(os.path.join(dirpath, filename))
+                kind = EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+                if kind == 'level' and not is_level_file(path):
+                    continue
+                if kind is not None:
+                    assets[path] = kind
+    classes = [GameObject]
+    for klass in classes:
+        classes.extend(klass.__subclasses__())
+        image = vars(klass).get('image')
+        if isinstance(image, LazyImage):
+            assets.setdefault(os.path.realpath(image.path), 'image')
+        if type(vars(klass).get('spritesheet')) == str:
+            assets.setdefault(os.path.realpath(klass.spritesheet), 'image')
+        if type(vars(klass).get('default_dialogue')) == str:
+            assets.setdefault(os.path.realpath(klass.default_dialogue), 'dialogue')
+    return [(kind, path) for path, kind in sorted(assets.items())]
+
+
+def bake_asset(kind, path, force=False):
+    """Bakes a single asset, unless it's already baked and up to date.
+    Returns whether it was baked and how many seconds that took."""
+    baker = BAKERS[kind]
+    if not force and baker.is_up_to_date(path):
+        return False, 0.0
+    start = time.perf_counter()
+    baker.bake(path)
+    return True, time.perf_counter() - start
+
+
+def bake(directories, jobs=None, force=False):
+    """Bakes the assets in the directories, on jobs processes, or one per
+    core. Returns (kind, path, baked, seconds, error) for every asset, where
+    error is the exception an asset failed to bake with, or None."""
+    assets = find_assets(directories)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(bake_asset, kind, path, force)
+            for kind, path in assets
+        ]
+        for (kind, path), future in zip(assets, futures):
+            try:
+                baked, seconds = future.result()
+            except Exception as error:
+                results.append((kind, path, False, 0.0, error))
+            else:
+                results.append((kind, path, baked, seconds, None))
+    return results
+
+
+def main():
+    """Runs the command, returning its exit status."""
+    parser = argparse.ArgumentParser(
+        prog='python -m game.bake', description=__doc__.split('\n\n')[0]
+    )
+    parser.add_argument(
+        'directories', nargs='*',
+        default=[os.path.join(constants.ROOT_DIR, 'assets')]
+    )
+    parser.add_argument('--jobs', type=int, help="how many processes to bake with")
+    parser.add_argument('--force', action='store_true', help="bake assets that are up to date too")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    results = bake(arguments.directories, arguments.jobs, arguments.force)
+    failures = [result for result in results if result[4] is not None]
+    for kind, path, baked, seconds, error in results:
+        if error is not None:
+            continue
+        if baked:
+            print('baked      {:<9} {} ({:.1f} ms)'.format(kind, path, seconds * 1000))
+        else:
+            print('up to date {:<9} {}'.format(kind, path))
+    for kind, path, _, _, error in failures:
+        print('failed     {:<9} {}: {}: {}'.format(
+            kind, path, type(error).__name__, error
+        ), file=sys.stderr)
+    print('Baked {} of {} assets in {:.2f} s{}'.format(
+        sum(1 for result in results if result[2]), len(results),
+        time.perf_counter() - start,
+        ', {} failed'.format(len(failures)) if failures else ''
+    ))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
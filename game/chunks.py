@@ -0,0 +1,178 @@
+import pygame
+
+from collections import OrderedDict
+
+from .profiling import profiler
+from .spatial import SpatialHash
+
+
+class StaticChunkLayer():
+    """
+    Pre-renders objects that never move into a grid of world-space chunk
+    surfaces, so that the static part of the world is drawn a few chunks at a
+    time instead of one object at a time.
+
+    Given the color the world is drawn over, chunks are rendered opaque on
+    top of it, so drawing one is a plain copy, and the layer fills in that
+    color wherever there's no chunk, so nothing needs to be drawn under it.
+    Otherwise chunks are rendered with per-pixel alpha, which is much slower
+    to draw.
+
+    Chunks are rendered the first time they're seen, and the least recently
+    used ones are dropped once more than max_chunks are held, so memory stays
+    bounded no matter how large the map is.
+
+    Baked objects keep their place in the depth order: after a sprite that
+    isn't baked is drawn, the blits from get_blits_in_front_of redraw, over
+    that sprite only, the baked objects that should appear in front of it.
+    """
+
+    DEFAULT_CHUNK_SIZE = 256
+    DEFAULT_MAX_CHUNKS = 32
+
+    def __init__(self, chunk_size=None, max_chunks=None, background_color=None):
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.max_chunks = max_chunks or self.DEFAULT_MAX_CHUNKS
+        self.background_color = background_color
+        # The objects are indexed on a finer grid than the chunks are cut
+        # from, so that finding the ones overlapping a single sprite only
+        # looks at those nearby.
+        self.objects = SpatialHash()
+        self.depth_keys = dict()
+        self.chunks = OrderedDict()
+        self.chunks_drawn = 0
+        # Chunk surfaces are a pixel wider than the chunks they hold, and only
+        # the chunk itself is drawn from them. Rows of a surface a multiple of
+        # four pixels wide line up on 16 byte boundaries, which SDL copies
+        # with streaming stores that make drawing an opaque chunk several
+        # times slower than its plain copy does.
+        self.chunk_rect = pygame.Rect(0, 0, self.chunk_size, self.chunk_size)
+        # What's drawn for empty chunks when the layer is opaque
+        self.empty_chunk = None
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, sprite):
+        return sprite in self.objects
+
+    def is_opaque(self):
+        """Whether drawing the layer covers everything under it."""
+        return self.background_color is not None
+
+    def add(self, sprite, depth_key):
+        """Bakes a sprite into the layer. The depth key orders it against the
+        other sprites, the same way GameGroup orders them."""
+        rect = sprite.get_world_rect('renderer')
+        self.objects.insert(sprite, rect)
+        self.depth_keys[sprite] = depth_key
+        self.invalidate(rect)
+
+    def remove(self, sprite):
+        if sprite not in self.objects:
+            return
+        self.invalidate(self.objects.get_rect(sprite))
+        self.objects.remove(sprite)
+        del self.depth_keys[sprite]
+
+    def invalidate(self, rect):
+        """Drops the chunks covering the given world-space rect, so they get
+        rendered again the next time they're drawn."""
+        for cell in self.iter_chunk_cells(rect):
+            self.chunks.pop(cell, None)
+
+    def iter_chunk_cells(self, rect):
+        """Yields the cells of the chunks covering a world-space rect."""
+        size = self.chunk_size
+        for cell_y in range(rect.top // size, max(rect.top, rect.bottom - 1) // size + 1):
+            for cell_x in range(rect.left // size, max(rect.left, rect.right - 1) // size + 1):
+                yield (cell_x, cell_y)
+
+    def clear(self):
+        self.objects = SpatialHash(self.objects.cell_size)
+        self.depth_keys.clear()
+        self.chunks.clear()
+
+    def get_chunk(self, cell):
+        if cell in self.chunks:
+            self.chunks.move_to_end(cell)
+            return self.chunks[cell]
+        chunk = self.render_chunk(cell)
+        self.chunks[cell] = chunk
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def render_chunk(self, cell):
+        """Returns a surface with every object overlapping the chunk drawn on
+        it in depth order, or None if the chunk is empty."""
+        chunk_area = pygame.Rect(
+            (cell[0] * self.chunk_size, cell[1] * self.chunk_size),
+            (self.chunk_size, self.chunk_size)
+        )
+        sprites = self.objects.collide(chunk_area)
+        if not sprites:
+            return None
+        chunk = self.new_chunk_surface()
+        for sprite in sorted(sprites, key=self.depth_keys.__getitem__):
+            rect = self.objects.get_rect(sprite)
+            chunk.blit(sprite.image, (rect.x - chunk_area.x, rect.y - chunk_area.y))
+        return chunk
+
+    def new_chunk_surface(self):
+        """Returns a surface to render a chunk onto, filled with the
+        background color, or transparent if there isn't one."""
+        size = (self.chunk_size + 1, self.chunk_size)
+        profiler.count('surfaces_allocated')
+        if self.background_color is None:
+            chunk = pygame.Surface(size, flags=pygame.SRCALPHA)
+            chunk.fill((0, 0, 0, 0))
+            return chunk
+        chunk = pygame.Surface(size).convert()
+        chunk.fill(self.background_color)
+        return chunk
+
+    def draw(self, surface, area, offset):
+        """Draws the chunks overlapping the world-space area onto the surface,
+        where the surface's origin lies at the given offset in the world."""
+        self.chunks_drawn = 0
+        for cell in self.iter_chunk_cells(area):
+            chunk = self.get_chunk(cell)
+            location = (
+                cell[0] * self.chunk_size - offset.x,
+                cell[1] * self.chunk_size - offset.y
+            )
+            if chunk is None and self.is_opaque():
+                if self.empty_chunk is None:
+                    self.empty_chunk = self.new_chunk_surface()
+                chunk = self.empty_chunk
+            if chunk is not None:
+                surface.blit(chunk, location, self.chunk_rect)
+                self.chunks_drawn += 1
+
+    def get_blits_in_front_of(self, sprite, depth_key, offset, get_blit):
+        """Returns the blits that redraw the baked objects belonging in front
+        of a sprite which has just been drawn over them, clipped to that
+        sprite's rect. get_blit turns an image, a destination and the area of
+        the image to draw into the arguments for Surface.blits."""
+        # They're sorted by depth below, so the order they're found in
+        # doesn't matter.
+        candidates = self.objects.candidates(sprite.rect)
+        profiler.count('collision_tests', len(candidates))
+        rects = self.objects.rects
+        in_front = [
+            baked for baked in candidates
+            if self.depth_keys[baked] > depth_key and rects[baked].colliderect(sprite.rect)
+        ]
+        if not in_front:
+            return []
+        blits = []
+        for baked in sorted(in_front, key=self.depth_keys.__getitem__):
+            rect = self.objects.get_rect(baked)
+            # Only the part overlapping the sprite is drawn
+            visible = rect.clip(sprite.rect)
+            area = visible.move(-rect.x, -rect.y)
+            blits.append(get_blit(
+                baked.image, (visible.x - offset.x, visible.y - offset.y), area
+            ))
+        return blits
@@ -0,0 +1,244 @@
+import numpy
+
+
+class ComponentStore():
+    """
+    Keeps the state of a set of entities that changes from frame to frame in
+    contiguous arrays, one row per entity, so that a system can update every
+    entity with the component it works on in a single vectorized pass instead
+    of one object at a time.
+
+    Which components each entity has is recorded in one boolean mask per
+    component. Rows are handed out as entities are added, reused once they're
+    removed, and the arrays double in size whenever they run out of rows, so
+    rows must be looked up in the store each time rather than held on to.
+
+    Animated entities don't keep a clock of their own. Instead, entities
+    playing the same animation since the same moment share a timeline, and
+    only the timelines are advanced. The store also keeps track of which
+    entities changed, by moving or by showing a different frame, so that only
+    those need their rects and images brought up to date.
+    """
+
+    # The origin of the entity in the world
+    POSITION = 'position'
+    # The direction the entity is heading in and how fast it goes there
+    VELOCITY = 'velocity'
+    # How far into the entity's current animation it is
+    ANIMATION = 'animation'
+    # The world-space rect the entity bumps into things with
+    COLLIDER = 'collider'
+    COMPONENTS = (POSITION, VELOCITY, ANIMATION, COLLIDER)
+
+    DEFAULT_CAPACITY = 64
+
+    def __init__(self, capacity=None):
+        capacity = capacity or self.DEFAULT_CAPACITY
+        self.capacity = 0
+        self.entities = []
+        self.rows = dict()
+        self.free_rows = []
+        self.masks = {
+            component: numpy.zeros(0, dtype=bool)
+            for component in self.COMPONENTS
+        }
+        self.positions = numpy.zeros((0, 2))
+        # Each axis of a direction is -1, 0 or 1, and speeds are in pixels per
+        # second per axis. Velocities are the distance moved during the last
+        # step, in pixels.
+        self.directions = numpy.zeros((0, 2))
+        self.speeds = numpy.zeros(0)
+        self.velocities = numpy.zeros((0, 2))
+        # The timeline each animated entity follows, and whether it switched
+        # to that timeline since animations were last advanced
+        self.animation_timelines = numpy.zeros(0, dtype=numpy.int64)
+        self.animation_restarted = numpy.zeros(0, dtype=bool)
+        # Whether the entity changed since the changes were last taken
+        self.changed = numpy.zeros(0, dtype=bool)
+        # Colliders are (x, y, width, height), offset from the position
+        self.collider_offsets = numpy.zeros((0, 4), dtype=numpy.int64)
+        self.colliders = numpy.zeros((0, 4), dtype=numpy.int64)
+        # Timelines are identified by the animation and the time, on the
+        # store's clock, the animation started. Clocks, lengths and timesteps
+        # are all in milliseconds. There are never more timelines than
+        # entities, so they're kept at the same capacity.
+        self.time = 0
+        self.timelines = dict()
+        self.timeline_keys = []
+        self.free_timelines = []
+        self.timeline_members = numpy.zeros(0, dtype=numpy.int64)
+        self.timeline_clocks = numpy.zeros(0, dtype=numpy.int64)
+        self.timeline_lengths = numpy.ones(0, dtype=numpy.int64)
+        self.timeline_timesteps = numpy.ones(0, dtype=numpy.int64)
+        self.grow(capacity)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, entity):
+        return entity in self.rows
+
+    def grow(self, capacity):
+        """Makes room for at least capacity entities."""
+        if capacity <= self.capacity:
+            return
+        added = capacity - self.capacity
+
+        def extend(array, fill=0):
+            extension = numpy.full((added,) + array.shape[1:], fill, dtype=array.dtype)
+            return numpy.concatenate((array, extension))
+
+        for component, mask in self.masks.items():
+            self.masks[component] = extend(mask, False)
+        self.positions = extend(self.positions)
+        self.directions = extend(self.directions)
+        self.speeds = extend(self.speeds)
+        self.velocities = extend(self.velocities)
+        self.animation_timelines = extend(self.animation_timelines, -1)
+        self.animation_restarted = extend(self.animation_restarted, False)
+        self.changed = extend(self.changed, False)
+        self.collider_offsets = extend(self.collider_offsets)
+        self.colliders = extend(self.colliders)
+        self.entities.extend([None] * added)
+        self.timeline_members = extend(self.timeline_members)
+        self.timeline_clocks = extend(self.timeline_clocks)
+        self.timeline_lengths = extend(self.timeline_lengths, 1)
+        self.timeline_timesteps = extend(self.timeline_timesteps, 1)
+        self.timeline_keys.extend([None] * added)
+        # Hand the lowest rows out first, so entities stay packed together
+        self.free_rows.extend(reversed(range(self.capacity, capacity)))
+        self.free_timelines.extend(reversed(range(self.capacity, capacity)))
+        self.capacity = capacity
+
+    def add(self, entity, components, position=(0, 0), collider=None, speed=0):
+        """Gives the entity a row with the given components, and returns the
+        row. A collider is given as an (x, y, width, height) offset from the
+        position."""
+        unknown = set(components) - set(self.COMPONENTS)
+        if unknown:
+            raise ValueError("Unknown components: {}".format(', '.join(sorted(unknown))))
+        if entity in self.rows:
+            raise ValueError("Entity was already added to the store")
+        if not self.free_rows:
+            self.grow(self.capacity * 2)
+        row = self.free_rows.pop()
+        self.entities[row] = entity
+        self.rows[entity] = row
+        for component, mask in self.masks.items():
+            mask[row] = component in components
+        self.positions[row] = position
+        self.directions[row] = (0, 0)
+        self.speeds[row] = speed
+        self.velocities[row] = (0, 0)
+        self.animation_timelines[row] = -1
+        self.animation_restarted[row] = False
+        self.changed[row] = True
+        if collider is None:
+            collider = (0, 0, 0, 0)
+        self.collider_offsets[row] = tuple(collider)
+        self.update_colliders([row])
+        return row
+
+    def remove(self, entity):
+        row = self.rows.pop(entity, None)
+        if row is None:
+            return
+        self.leave_timeline(row)
+        self.entities[row] = None
+        for mask in self.masks.values():
+            mask[row] = False
+        self.changed[row] = False
+        self.free_rows.append(row)
+
+    def has_component(self, row, component):
+        return bool(self.masks[component][row])
+
+    def mark_changed(self, row):
+        """Records that the entity changed in a way the systems can't see, so
+        that it's brought up to date along with the ones they changed."""
+        self.changed[row] = True
+
+    def take_changed(self):
+        """Returns the entities that changed since this was last called."""
+        rows = numpy.flatnonzero(self.changed)
+        self.changed[rows] = False
+        return [self.entities[row] for row in rows]
+
+    def update_colliders(self, rows):
+        self.colliders[rows, :2] = self.positions[rows] + self.collider_offsets[rows, :2]
+        self.colliders[rows, 2:] = self.collider_offsets[rows, 2:]
+
+    def integrate_movement(self, ms):
+        """Moves every entity with a velocity as far as it goes in the given
+        number of milliseconds. Returns the rows of the entities that moved."""
+        moving = numpy.flatnonzero(self.masks[self.VELOCITY])
+        self.velocities[moving] = (
+            self.directions[moving] * self.speeds[moving, numpy.newaxis] * ms / 1000
+        )
+        # Like Rect.move, entities only move by whole pixels
+        steps = numpy.trunc(self.velocities[moving])
+        self.positions[moving] += steps
+        moved = moving[numpy.any(steps != 0, axis=1)]
+        self.update_colliders(moved[self.masks[self.COLLIDER][moved]])
+        self.changed[moved] = True
+        return moved
+
+    def start_animation(self, row, animation_key, length, timestep, time_elapsed=0):
+        """Puts an entity on the timeline of the animation that started
+        time_elapsed milliseconds ago, which is shared with any other entity
+        that's already on it. The animation key identifies the animation, and
+        length and timestep are the length of the animation and of its frames.
+        """
+        key = (animation_key, self.time - time_elapsed)
+        timeline = self.timelines.get(key)
+        if timeline is not None and timeline == self.animation_timelines[row]:
+            return
+        self.leave_timeline(row)
+        if timeline is None:
+            timeline = self.free_timelines.pop()
+            self.timelines[key] = timeline
+            self.timeline_keys[timeline] = key
+            self.timeline_clocks[timeline] = time_elapsed % length
+            self.timeline_lengths[timeline] = length
+            self.timeline_timesteps[timeline] = timestep
+        self.timeline_members[timeline] += 1
+        self.animation_timelines[row] = timeline
+        self.animation_restarted[row] = True
+
+    def leave_timeline(self, row):
+        timeline = self.animation_timelines[row]
+        if timeline < 0:
+            return
+        self.animation_timelines[row] = -1
+        self.timeline_members[timeline] -= 1
+        if self.timeline_members[timeline] == 0:
+            del self.timelines[self.timeline_keys[timeline]]
+            self.timeline_keys[timeline] = None
+            self.free_timelines.append(timeline)
+
+    def get_animation_clock(self, row):
+        """Returns how many milliseconds into its animation an entity is."""
+        return int(self.timeline_clocks[self.animation_timelines[row]])
+
+    def advance_animations(self, ms):
+        """Advances every timeline by the given number of milliseconds,
+        wrapping around at the end of its animation. Returns the rows of the
+        animated entities whose frame changed."""
+        self.time += ms
+        active = numpy.flatnonzero(self.timeline_members)
+        clocks = self.timeline_clocks[active]
+        timesteps = self.timeline_timesteps[active]
+        previous_frames = clocks // timesteps
+        clocks = (clocks + ms) % self.timeline_lengths[active]
+        self.timeline_clocks[active] = clocks
+        frame_changed = numpy.zeros(self.capacity, dtype=bool)
+        frame_changed[active] = clocks // timesteps != previous_frames
+
+        animated = numpy.flatnonzero(self.masks[self.ANIMATION])
+        changed = animated[
+            frame_changed[self.animation_timelines[animated]] |
+            self.animation_restarted[animated]
+        ]
+        self.animation_restarted[animated] = False
+        self.changed[changed] = True
+        return changed
@@ -7,6 +7,9 @@ ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 
 FPS = 30
 
+# What the world is drawn over
+BACKGROUND_COLOR = (128, 128, 155)
+
 INTERACTION_CHAT = pygame.USEREVENT + 0
 
 
@@ -15,6 +18,8 @@ class GameModes(Enum):
     PLAYING = 0
     # Usually meaning a textbox is open
     CINEMATIC = 1
+    # Waiting on a level to load before there's anything to play
+    LOADING = 2
 
 
 class Directions(Enum):
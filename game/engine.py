@@ -1,14 +1,180 @@
 #!/usr/bin/env python3
 
-import pygame
+import pygame, threading
 
 from . import constants
+from .chunks import StaticChunkLayer
+from .components import ComponentStore
 from .constants import GameModes
 from .cutscenes import CutScene
-from .gameobjects import Player, GameObject, GameGroup, Pointer, Wall, KillFace
-from .graphics import TextBox, TextBoxPage
+from .gameobjects import Player, GameObject, GameGroup
+from .graphics import Animator, PerformanceHUD, TextureAtlas
+from .graphics import LazyImage, find_slow_surfaces
 from .utilities import get_asset_path
-from .levels import Level
+from .levels import CompiledLevel, Level
+from .profiling import profiled, profiler
+from .replay import InputPlayback, InputRecording
+from .streaming import StreamedLevel
+
+
+class GameObjectGroups():
+    """
+    The groups a level's objects are sorted into, depending on what each
+    object can do, along with the ComponentStore holding the state of the
+    dynamic ones. They're kept together so that a whole new set can be built
+    ahead of time, away from the running game, and swapped in at once.
+    """
+
+    def __init__(self):
+        self.player = None
+        self.components = ComponentStore()
+        self.interactable_objects = GameGroup(spatial_index='base')
+        self.dynamic_objects = GameGroup()
+        # The dynamic objects whose update has anything to do, out of all of
+        # those the ComponentStore steps
+        self.updated_objects = pygame.sprite.Group()
+        self.static_objects = GameGroup(spatial_index='collider')
+        self.all_objects = GameGroup(
+            spatial_index='renderer',
+            static_layer=StaticChunkLayer(background_color=constants.BACKGROUND_COLOR)
+        )
+
+    # How many objects to sort between calls to the progress callback
+    PROGRESS_INTERVAL = 256
+
+    @classmethod
+    def from_level(cls, level, progress=None):
+        """Sorts the objects of a level into a new set of groups. If given,
+        progress is called with the fraction of objects sorted so far."""
+        groups = cls()
+        for i, gameobject in enumerate(level.gameobjects, 1):
+            groups.add(gameobject)
+            if progress and i % cls.PROGRESS_INTERVAL == 0:
+                progress(i / len(level.gameobjects))
+        groups.build_atlas()
+        return groups
+
+    def build_atlas(self):
+        """Packs the images the objects are drawn with into an atlas, which
+        the objects are then drawn from. Objects added later are drawn from
+        their own images unless the atlas is built again."""
+        self.all_objects.atlas = TextureAtlas.from_gameobjects(self.all_objects)
+
+    def add(self, gameobject):
+        """Sorts an object into the groups matching what its components let
+        it do."""
+        if isinstance(gameobject, Player):
+            self.player = gameobject
+        if gameobject.is_interactable():
+            self.interactable_objects.add(gameobject)
+        if gameobject.is_dynamic():
+            gameobject.attach(self.components)
+            self.dynamic_objects.add(gameobject)
+            if gameobject.has_own_update():
+                self.updated_objects.add(gameobject)
+        if gameobject.is_obstacle():
+            self.static_objects.add(gameobject)
+        self.all_objects.add(gameobject)
+        if gameobject.is_bakeable():
+            self.all_objects.bake(gameobject)
+
+    def remove(self, gameobject):
+        """Removes an object from every group, giving up its assets."""
+        gameobject.release_assets()
+        gameobject.detach()
+        for group in (
+            self.interactable_objects, self.dynamic_objects,
+            self.updated_objects, self.static_objects, self.all_objects
+        ):
+            group.remove(gameobject)
+        if gameobject is self.player:
+            self.player = None
+
+    def clear(self):
+        """Removes every object from the groups, giving up their assets."""
+        for gameobject in self.all_objects:
+            gameobject.release_assets()
+            gameobject.detach()
+        self.dynamic_objects.empty()
+        self.updated_objects.empty()
+        self.static_objects.empty()
+        self.interactable_objects.empty()
+        self.all_objects.empty()
+        self.player = None
+
+
+class LoadCancelled(Exception):
+    """Raised on a LevelLoader's worker thread to stop it once it's
+    cancelled."""
+
+
+class LevelLoader():
+    """
+    Loads a level file on a worker thread: reading and parsing it, decoding
+    its assets, and building and sorting its objects into a new set of
+    GameObjectGroups, all while the current level keeps running. A load can
+    be cancelled, which gives up the assets of everything it built.
+    """
+
+    # How much of the progress is spent building the level's objects, rather
+    # than sorting them into groups
+    BUILD_SHARE = 0.6
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.progress = 0.0
+        self.groups = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._load, daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        level = None
+        try:
+            level = Level.load_from_file(self.filename, progress=self._building)
+            groups = GameObjectGroups.from_level(level, progress=self._sorting)
+            self.progress = 1.0
+            self.groups = groups
+        except LoadCancelled:
+            # Objects built before the level was, if it was, have already
+            # given up their assets
+            if level is not None:
+                for gameobject in level.gameobjects:
+                    gameobject.release_assets()
+        except Exception as error:
+            self.error = error
+
+    def _building(self, fraction):
+        if self.cancelled.is_set():
+            raise LoadCancelled()
+        self.progress = fraction * self.BUILD_SHARE
+
+    def _sorting(self, fraction):
+        if self.cancelled.is_set():
+            raise LoadCancelled()
+        self.progress = self.BUILD_SHARE + fraction * (1 - self.BUILD_SHARE)
+
+    def cancel(self):
+        """Stops the load and waits for the worker thread to finish. Whatever
+        it built gives up its assets, including the groups if it got as far
+        as finishing them."""
+        self.cancelled.set()
+        self.thread.join()
+        if self.groups is not None:
+            self.groups.clear()
+            self.groups = None
+
+    def ready(self):
+        """Whether the groups are built and can be swapped in."""
+        return self.groups is not None
+
+    def finished(self):
+        """Whether the loader is done, either successfully or with an error."""
+        return self.ready() or self.error is not None
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
 
 
 # TODO: add save files
@@ -17,64 +183,312 @@ class GameState():
 
     SCREEN_SIZE = (512, 288)
     SCROLL_MARGIN = 80
+    BACKGROUND_COLOR = constants.BACKGROUND_COLOR
+    # Whether to drop decoded spritesheets no object uses anymore once the
+    # objects of a level are cleared out.
+    EVICT_UNUSED_ASSETS = True
+    # Shows or hides the performance HUD, and writes what the profiler
+    # recorded to TRACE_FILENAME as a Chrome trace
+    HUD_KEY = pygame.K_F3
+    TRACE_KEY = pygame.K_F4
+    TRACE_FILENAME = 'trace.json'
+    STARTING_LEVEL = 'test.json'
+    LOADING_BAR_SIZE = (256, 8)
+    LOADING_BAR_COLOR = (255, 255, 255)
 
-    def __init__(self):
+    def __init__(self, dirty_rendering=False, profiling=False):
         self.display = pygame.display.set_mode(self.SCREEN_SIZE)
+        # Images loaded before there was a display can only now be converted
+        GameObject.optimize_class_images()
         self.clock = pygame.time.Clock()
         self.step_delta = 0
-        self.mode = GameModes.PLAYING
+        # Milliseconds of game time stepped through so far
+        self.time = 0
+        self.mode = GameModes.LOADING
         self.cutscene = None
         self.keydowns = set()
+        # The state of every key, as of the last time events were processed
+        self.pressed_keys = pygame.key.get_pressed()
+        # The dynamic objects that changed during the last step
+        self.changed_objects = []
 
-        self.player = None
-        self.interactable_objects = GameGroup()
-        self.dynamic_objects = GameGroup()
-        self.static_objects = GameGroup()
-        self.all_objects = GameGroup()
-        self.load_level(Level.load_from_file('test.json'))
+        # When dirty rendering, frames where the camera stays still only redraw
+        # and push the areas of the screen where dynamic objects changed.
+        self.dirty_rendering = dirty_rendering
+        self.background = None
+        self.force_full_redraw = True
+        self.last_drawn_mode = None
+        self.last_drawn_offset = None
+        self.last_screen_states = dict()
+
+        # The profiler runs while asked to, or while the HUD is showing
+        self.profiling = profiling
+        self.hud = PerformanceHUD(profiler)
+        self.showing_hud = False
+        profiler.enabled = profiling
+
+        # While recording, the input of every step is added to the recording.
+        # While replaying, steps run on the recorded input and step lengths
+        # instead, and only draw if rendering.
+        self.input_recording = None
+        self.input_playback = None
+        self.rendering = True
+
+        self.level_loader = None
+        self.streamed_level = None
+        self.reported_surfaces = False
+        self.use_groups(GameObjectGroups())
+        # The starting level loads while the first frames are shown, rather
+        # than before anything is.
+        self.load_level_in_background(self.STARTING_LEVEL)
+        self.draw()
+
+    def use_groups(self, groups):
+        self.groups = groups
+        self.player = groups.player
+        self.interactable_objects = groups.interactable_objects
+        self.dynamic_objects = groups.dynamic_objects
+        self.static_objects = groups.static_objects
+        self.all_objects = groups.all_objects
+        self.force_full_redraw = True
+        self.last_screen_states = dict()
+
+    def get_surfaces(self):
+        """Returns (name, surface) pairs for the images the game draws from:
+        those of the object classes, the decoded spritesheets, the distinct
+        images of the objects in the level and the pages of its atlas."""
+        surfaces = []
+        classes = [GameObject]
+        for klass in classes:
+            classes.extend(klass.__subclasses__())
+            image = vars(klass).get('image')
+            if isinstance(image, LazyImage):
+                # Images that haven't been used yet aren't loaded at all
+                image = image.image
+            if image is not None:
+                surfaces.append(('{}.image'.format(klass.__name__), image))
+        for key, (sheets, _) in Animator.registry.items():
+            for sheet, name in zip(sheets, key[0]):
+                surfaces.append((str(name), sheet))
+        # Objects of the same class mostly share their images
+        object_images = dict()
+        for gameobject in self.all_objects:
+            object_images.setdefault(gameobject.base_image, type(gameobject).__name__)
+        for image, class_name in object_images.items():
+            surfaces.append(('image of a {}'.format(class_name), image))
+        if self.all_objects.atlas is not None:
+            for i, page in enumerate(self.all_objects.atlas.pages):
+                surfaces.append(('atlas page {}'.format(i), page))
+        return surfaces
+
+    def report_slow_surfaces(self):
+        """Prints the images that still have to be converted every time
+        they're blitted, since they aren't in the display's pixel format.
+        Only done once, while profiling."""
+        slow_surfaces = find_slow_surfaces(self.get_surfaces())
+        if slow_surfaces:
+            print('{} surfaces are not in the display format:'.format(len(slow_surfaces)))
+            for name in slow_surfaces:
+                print('  ' + name)
+
+    def swap_groups(self, groups):
+        """Switches over to a new set of groups, clearing out the old ones, and
+        starts playing on them. A level still loading in the background is
+        cancelled."""
+        self.cancel_loading()
+        self.replace_groups(groups)
+        if self.mode == GameModes.LOADING:
+            self.mode = GameModes.PLAYING
+        if self.profiling and not self.reported_surfaces and self.player is not None:
+            # By the time the first level is in, every image it uses is
+            # loaded and should have been converted.
+            self.reported_surfaces = True
+            self.report_slow_surfaces()
+
+    def replace_groups(self, groups):
+        old_groups = self.groups
+        self.streamed_level = None
+        self.use_groups(groups)
+        old_groups.clear()
+        if self.EVICT_UNUSED_ASSETS:
+            Animator.registry.evict_unreferenced()
 
     def clear_gameobjects(self):
-        self.dynamic_objects.empty()
-        self.static_objects.empty()
-        self.interactable_objects.empty()
-        self.all_objects.empty()
+        """Removes every object, leaving the game without a player. A level
+        loading in the background carries on, and the game keeps showing
+        that it's loading until the level is swapped in."""
+        self.replace_groups(GameObjectGroups())
 
     def load_level(self, level):
-        self.clear_gameobjects()
-        for gameobject in level.gameobjects:
-            # TODO: This needs a major rework: remove can_interact and can_move
-            #       and instead calculate the capabilities of each given object
-            #       based on the components they have.
-            if isinstance(gameobject, Player):
-                self.player = gameobject
-            if isinstance(gameobject, KillFace):
-                self.static_objects.add(gameobject)
-            if gameobject.can_interact:
-                self.interactable_objects.add(gameobject)
-            if gameobject.can_move:
-                self.dynamic_objects.add(gameobject)
-            else:
-                self.static_objects.add(gameobject)
-            self.all_objects.add(gameobject)
+        self.swap_groups(GameObjectGroups.from_level(level))
+
+    def load_streamed_level(self, filename, **kwargs):
+        """Starts playing a level whose regions are loaded and unloaded as the
+        camera moves through it. Keyword arguments go to StreamedLevel."""
+        compiled_level = CompiledLevel.load_cached(get_asset_path(filename))
+        streamed_level = StreamedLevel(compiled_level, **kwargs)
+        groups = GameObjectGroups()
+        for gameobject in streamed_level.build_persistent_objects():
+            groups.add(gameobject)
+        self.swap_groups(groups)
+        self.streamed_level = streamed_level
+        # The first regions are loaded around the camera, so it has to be on
+        # the player before they are
+        self.center_camera_on_player()
+        self.update_streamed_level()
+        self.groups.build_atlas()
+
+    @profiled('GameState.update_streamed_level')
+    def update_streamed_level(self):
+        if self.streamed_level is None:
+            return
+        camera = pygame.Rect(tuple(self.all_objects.offset), self.SCREEN_SIZE)
+        loaded, unloaded = self.streamed_level.update(camera)
+        for gameobject in unloaded:
+            self.groups.remove(gameobject)
+        for gameobject in loaded:
+            self.groups.add(gameobject)
+        if loaded or unloaded:
+            self.force_full_redraw = True
+        if unloaded and self.EVICT_UNUSED_ASSETS:
+            Animator.registry.evict_unreferenced()
+
+    def load_level_in_background(self, filename):
+        """Starts loading a level file without holding up the game. The level
+        is swapped in at the start of the first step after it's ready. Any
+        other level still loading is cancelled."""
+        self.cancel_loading()
+        self.level_loader = LevelLoader(filename)
+        return self.level_loader
+
+    def cancel_loading(self):
+        """Cancels the level loading in the background, if any."""
+        if self.level_loader is not None:
+            self.level_loader.cancel()
+            self.level_loader = None
+
+    def get_loading_progress(self):
+        """Returns how far along, from 0 to 1, a level loading in the
+        background is, or None if no level is loading."""
+        if self.level_loader is None:
+            return None
+        return self.level_loader.progress
+
+    def finish_loading(self):
+        """Waits for the level loading in the background, if any, and swaps
+        it in."""
+        if self.level_loader is not None:
+            self.level_loader.wait()
+            self.swap_in_loaded_level()
+
+    def swap_in_loaded_level(self):
+        loader = self.level_loader
+        if loader is None or not loader.finished():
+            return
+        self.level_loader = None
+        if loader.error is not None:
+            raise loader.error
+        self.swap_groups(loader.groups)
+
+    @profiled('GameState.tick')
+    def tick(self):
+        """Waits out the rest of the frame, and returns how many milliseconds
+        passed since the last one. While replaying, the recorded time is
+        returned right away instead."""
+        if self.input_playback is not None:
+            return self.input_playback.next_frame().step_delta
+        return self.clock.tick(constants.FPS)
 
+    def read_pressed_keys(self):
+        if self.input_playback is not None:
+            return self.input_playback.frame.get_pressed_keys()
+        return pygame.key.get_pressed()
+
+    def get_events(self):
+        """Returns the events to process this step. While replaying, the
+        keyboard is ignored and the recorded keydowns are used instead."""
+        events = pygame.event.get()
+        if self.input_playback is None:
+            return events
+        recorded_events = [
+            pygame.event.Event(pygame.KEYDOWN, key=key, mod=mod)
+            for key, mod in self.input_playback.frame.keydowns
+        ]
+        return recorded_events + [
+            event for event in events
+            if event.type not in (pygame.KEYDOWN, pygame.KEYUP)
+        ]
+
+    @profiled('GameState.process_events')
     def process_events(self):
         self.keydowns.clear()
-        for event in pygame.event.get():
+        keydown_mods = []
+        for event in self.get_events():
             if event.type == pygame.QUIT:
                 quit()
             if event.type == pygame.KEYDOWN:
                 self.keydowns.add(event.key)
+                keydown_mods.append((event.key, event.mod))
                 ctrl_mod = (event.mod & pygame.KMOD_CTRL) > 0
                 if event.key == pygame.K_q and ctrl_mod:
                     pygame.event.post(pygame.event.Event(pygame.QUIT))
-            if self.mode == GameModes.PLAYING:
+                elif event.key == self.HUD_KEY:
+                    self.toggle_hud()
+                elif event.key == self.TRACE_KEY:
+                    self.export_trace()
+            # Chats are started by the player, and one still queued after the
+            # player is gone is dropped.
+            if self.mode == GameModes.PLAYING and self.player is not None:
                 if event.type == constants.INTERACTION_CHAT:
                     self.mode = GameModes.CINEMATIC
                     self.cutscene = CutScene(cue_list=['chat'])
                     self.cutscene.edit_cue('chat', 0, textbox=event.gameobject.chat(self))
                     self.cutscene.start()
+        # Read once events are pumped, so it's in step with them
+        self.pressed_keys = self.read_pressed_keys()
+        if self.input_recording is not None:
+            self.input_recording.record(self.step_delta, keydown_mods, self.pressed_keys)
+
+    def start_recording(self):
+        """Starts recording the input of every step, and returns the
+        recording. Replaying it needs the game to start out as it is now,
+        so any level loading in the background is waited for first."""
+        self.finish_loading()
+        self.input_recording = InputRecording()
+        return self.input_recording
+
+    def stop_recording(self):
+        recording, self.input_recording = self.input_recording, None
+        return recording
+
+    def replay(self, recording, render=True):
+        """Runs a step for each frame of a recording, on its input and step
+        lengths, without waiting out frames. Without rendering, nothing is
+        drawn, so it runs as fast as the game logic does."""
+        self.finish_loading()
+        self.input_playback = InputPlayback(recording)
+        self.rendering = render
+        try:
+            while not self.input_playback.finished():
+                self.step()
+        finally:
+            self.input_playback = None
+            self.rendering = True
+            self.force_full_redraw = True
 
+    def toggle_hud(self):
+        self.showing_hud = not self.showing_hud
+        profiler.enabled = self.profiling or self.showing_hud
+        self.force_full_redraw = True
+
+    def export_trace(self, path=None):
+        """Writes what the profiler recorded as a Chrome trace-event file."""
+        profiler.export_chrome_trace(path or self.TRACE_FILENAME)
+
+    @profiled('GameState.adjust_camera_for_player')
     def adjust_camera_for_player(self):
+        if self.player is None:
+            return
         screen_left, screen_top = self.all_objects.offset
         margin_left = screen_left + self.SCROLL_MARGIN
         margin_right = screen_left + self.SCREEN_SIZE[0] - self.SCROLL_MARGIN
@@ -95,27 +509,149 @@ class GameState():
 
         self.scroll_camera(scroll_x, scroll_y)
 
+    def center_camera_on_player(self):
+        if self.player is None:
+            return
+        screen_left, screen_top = self.all_objects.offset
+        self.scroll_camera(
+            self.player.rect.centerx - self.SCREEN_SIZE[0] // 2 - screen_left,
+            self.player.rect.centery - self.SCREEN_SIZE[1] // 2 - screen_top
+        )
+
     def scroll_camera(self, x, y):
         self.all_objects.scroll(x, y)
 
+    @profiled('GameState.update_objects')
+    def update_objects(self):
+        """Steps every dynamic object. Movement and animation are run for all
+        of them at once by the ComponentStore, with the logic of the objects
+        that have any, such as collisions, run in between."""
+        components = self.groups.components
+        if self.player is not None:
+            self.player.control(self)
+        components.integrate_movement(self.step_delta)
+        self.groups.updated_objects.update(self)
+        components.advance_animations(self.step_delta)
+        # Only the objects that moved or changed frame need their rects and
+        # images, and everything derived from them, brought up to date.
+        self.changed_objects = components.take_changed()
+        for gameobject in self.changed_objects:
+            gameobject.refresh()
+
+    @profiled('GameState.step')
     def step(self):
-        self.step_delta = self.clock.tick(constants.FPS)
+        # Closes off the previous step, now that its time is recorded
+        profiler.end_frame()
+        self.swap_in_loaded_level()
+        self.step_delta = self.tick()
+        self.time += self.step_delta
+        self.changed_objects = []
         self.process_events()
         if self.mode == GameModes.PLAYING:
-            self.dynamic_objects.update(self)
+            self.update_objects()
             self.adjust_camera_for_player()
+            self.update_streamed_level()
         elif self.mode == GameModes.CINEMATIC:
             self.cutscene.update(self)
             if self.cutscene.finished:
                 self.cutscene = None
                 self.mode = GameModes.PLAYING
-                self.player.last_chatted = pygame.time.get_ticks()
-        self.draw()
+                if self.player is not None:
+                    self.player.last_chatted = self.time
+        if self.rendering:
+            self.draw()
         return self.step_delta
 
+    @profiled('GameState.draw')
     def draw(self):
-        self.display.fill((128, 128, 155))
+        full_redraw = not self.dirty_rendering or self.needs_full_redraw()
+        if full_redraw:
+            self.draw_full()
+        else:
+            self.draw_dirty_areas()
+        self.force_full_redraw = False
+        self.last_drawn_mode = self.mode
+        self.last_drawn_offset = tuple(self.all_objects.offset)
+        if self.dirty_rendering:
+            # Objects that didn't change are still where they were last time,
+            # unless the whole screen moved.
+            if full_redraw:
+                self.last_screen_states = self.get_screen_states(self.dynamic_objects)
+            else:
+                self.last_screen_states.update(self.get_screen_states(self.changed_objects))
+
+    def draw_full(self):
+        if not self.all_objects.draws_background():
+            self.display.fill(self.BACKGROUND_COLOR)
         self.all_objects.draw(self.display)
+        if self.mode == GameModes.LOADING:
+            self.draw_loading_bar()
         if self.mode == GameModes.CINEMATIC:
             self.cutscene.draw(self.display)
+        if self.showing_hud:
+            self.hud.draw(self.display)
         pygame.display.flip()
+
+    def draw_loading_bar(self):
+        """Draws how far along the level loading in the background is."""
+        bar = pygame.Rect((0, 0), self.LOADING_BAR_SIZE)
+        bar.center = self.display.get_rect().center
+        self.display.fill(self.LOADING_BAR_COLOR, bar)
+        progress = self.get_loading_progress() or 0
+        inner = bar.inflate(-2, -2)
+        self.display.fill(self.BACKGROUND_COLOR, inner)
+        inner.width = int(inner.width * progress)
+        self.display.fill(self.LOADING_BAR_COLOR, inner)
+
+    def needs_full_redraw(self):
+        """Whether the last frame drawn can't be patched up into this one, such
+        as when the camera scrolled or a textbox or the HUD is showing."""
+        return (
+            self.force_full_redraw or
+            self.showing_hud or
+            self.mode == GameModes.LOADING or
+            self.mode == GameModes.CINEMATIC or
+            self.mode != self.last_drawn_mode or
+            tuple(self.all_objects.offset) != self.last_drawn_offset
+        )
+
+    def get_screen_states(self, sprites):
+        """Returns where on the screen each of the sprites is, and with what
+        image, so the next frame can tell which of them changed."""
+        offset_x, offset_y = self.all_objects.offset
+        return {
+            sprite: (sprite.rect.move(-offset_x, -offset_y), sprite.image)
+            for sprite in sprites
+        }
+
+    def get_dirty_rects(self):
+        """Returns the areas of the screen covered by dynamic objects that
+        changed since the last frame, both where they were and where they are."""
+        screen = self.display.get_rect()
+        dirty_rects = []
+        for sprite, state in self.get_screen_states(self.changed_objects).items():
+            previous_state = self.last_screen_states.get(sprite)
+            if state == previous_state:
+                continue
+            dirty_rect = state[0]
+            if previous_state:
+                previous_rect = previous_state[0]
+                if previous_rect.colliderect(dirty_rect):
+                    dirty_rect = dirty_rect.union(previous_rect)
+                else:
+                    dirty_rects.append(previous_rect.clip(screen))
+            dirty_rects.append(dirty_rect.clip(screen))
+        return [rect for rect in dirty_rects if rect.width and rect.height]
+
+    def draw_dirty_areas(self):
+        if self.background is None:
+            self.background = pygame.Surface(self.SCREEN_SIZE).convert()
+            self.background.fill(self.BACKGROUND_COLOR)
+        dirty_rects = self.get_dirty_rects()
+        for rect in dirty_rects:
+            self.display.set_clip(rect)
+            if not self.all_objects.draws_background():
+                self.display.blit(self.background, rect, rect)
+            self.all_objects.draw(self.display, rect)
+        self.display.set_clip(None)
+        pygame.display.update(dirty_rects)
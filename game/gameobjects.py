@@ -1,38 +1,221 @@
 import pygame
 
-from contextlib import contextmanager
+from itertools import count
 
 from . import constants
+from .components import ComponentStore
 from .constants import Directions
-from .graphics import Animator, TextBox
+from .graphics import Animator, CompiledImageCache, LazyImage, TextBox, optimize_surface
+from .ordering import SortedList
+from .profiling import profiled, profiler
+from .spatial import SpatialHash
 from .utilities import get_asset_path
 
 
 class GameGroup(pygame.sprite.Group):
-    def __init__(self, *args):
+    def __init__(self, *args, spatial_index=None, static_layer=None):
+        # When given the name of a rect option, the group keeps its sprites in
+        # a spatial hash keyed on that rect, in world space, so that collision
+        # queries only need to test the sprites nearby.
+        self.indexed_rect = spatial_index
+        self.spatial_index = None
+        if spatial_index:
+            self.spatial_index = SpatialHash()
+        # Sprites are kept sorted by the bottom edge of their rect across
+        # frames, so that only the sprites that moved need to be re-sorted.
+        # Entries are (bottom, insertion number, sprite); the insertion number
+        # keeps sprites at the same height in the order they were added.
+        # Sprites added since the order was last needed wait in a list of
+        # their own, so that adding many at once sorts them in one go.
+        self.depth_order = SortedList()
+        self.unsorted_entries = []
+        self.depth_keys = dict()
+        self._insertion_counter = count()
+        # Sprites baked into a StaticChunkLayer are drawn a chunk at a time
+        # instead of individually. They're left out of the depth order and
+        # spatial index, so that drawing never has to look at them one by
+        # one, and are found through the layer instead.
+        self.static_layer = static_layer
+        # When set, sprites whose image is in the TextureAtlas are drawn from
+        # its pages.
+        self.atlas = None
         super().__init__(*args)
         self.offset = Vector(0, 0)
-
-    def draw(self, surface):
-        for sprite in self.sprites_by_bottom_edge_height():
-            offset = (sprite.rect.x - self.offset.x, sprite.rect.y - self.offset.y)
-            surface.blit(sprite.image, offset)
-
-    @contextmanager
-    def select_rect(self, rectname):
-        prior_states = dict()
+        # How many sprites the last call to draw blitted, how many are drawn
+        # as part of the static layer, and how many of the rest it skipped for
+        # lying outside of the target surface.
+        self.drawn_count = 0
+        self.baked_count = 0
+        self.culled_count = 0
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        depth_key = (sprite.rect.bottom, next(self._insertion_counter))
+        self.depth_keys[sprite] = depth_key
+        self.unsorted_entries.append(depth_key + (sprite,))
+        if self.spatial_index is not None:
+            rect = sprite.get_world_rect(self.indexed_rect)
+            self.spatial_index.insert(sprite, rect)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if self.static_layer is not None and sprite in self.static_layer:
+            self.static_layer.remove(sprite)
+            del self.depth_keys[sprite]
+            return
+        self.sort_entries()
+        self.depth_order.remove(self.depth_keys.pop(sprite) + (sprite,))
+        if self.spatial_index is not None:
+            self.spatial_index.remove(sprite)
+
+    def empty(self):
+        """Removes every sprite, dropping the depth order, spatial index and
+        static layer all at once rather than a sprite at a time."""
+        self.depth_order.clear()
+        self.unsorted_entries = []
+        self.depth_keys.clear()
+        if self.spatial_index is not None:
+            self.spatial_index = SpatialHash(self.spatial_index.cell_size)
+        if self.static_layer is not None:
+            self.static_layer.clear()
         for sprite in self.sprites():
-            prior_states[sprite] = sprite.current_rect
-            sprite.select_rect(rectname)
-        yield
-        for sprite, prior_rect in prior_states.items():
-            sprite.select_rect(prior_rect)
+            super().remove_internal(sprite)
+            sprite.remove_internal(self)
+
+    def reindex(self, sprite):
+        """Lets the group know that one of its sprites may have moved."""
+        bottom, insertion_number = self.depth_keys[sprite]
+        if self.static_layer is not None and sprite in self.static_layer:
+            # Baked sprites aren't meant to move, but if one does, it's baked
+            # again where it is now.
+            self.depth_keys[sprite] = (sprite.rect.bottom, insertion_number)
+            self.static_layer.remove(sprite)
+            self.static_layer.add(sprite, self.depth_keys[sprite])
+            return
+        if sprite.rect.bottom != bottom:
+            self.sort_entries()
+            self.depth_order.remove((bottom, insertion_number, sprite))
+            depth_key = (sprite.rect.bottom, insertion_number)
+            self.depth_keys[sprite] = depth_key
+            self.depth_order.add(depth_key + (sprite,))
+        if self.spatial_index is not None:
+            rect = sprite.get_world_rect(self.indexed_rect)
+            self.spatial_index.move(sprite, rect)
+
+    def sort_entries(self):
+        """Sorts the sprites added since the last time into the depth order."""
+        if self.unsorted_entries:
+            self.depth_order.update(self.unsorted_entries)
+            self.unsorted_entries = []
+
+    def draws_background(self):
+        """Whether drawing the group covers the whole area drawn, so that
+        nothing needs to be drawn under it first."""
+        return self.static_layer is not None and self.static_layer.is_opaque()
+
+    def bake(self, sprite):
+        """Moves one of the group's sprites into its static layer."""
+        self.sort_entries()
+        self.depth_order.remove(self.depth_keys[sprite] + (sprite,))
+        if self.spatial_index is not None:
+            self.spatial_index.remove(sprite)
+        self.static_layer.add(sprite, self.depth_keys[sprite])
+
+    def collide(self, rect):
+        """Returns the sprites whose indexed rect overlaps the given world-space
+        rect."""
+        if self.static_layer is not None:
+            baked = self.static_layer.objects.collide(rect)
+        else:
+            baked = []
+        if self.spatial_index is not None:
+            return self.spatial_index.collide(rect) + baked
+        profiler.count('collision_tests', len(self))
+        return [
+            sprite for sprite in self.sprites()
+            if sprite.rect.colliderect(rect)
+        ]
+
+    def get_indexed_rect(self, sprite):
+        """Returns the world-space rect a sprite is indexed by."""
+        if self.static_layer is not None and sprite in self.static_layer:
+            return self.static_layer.objects.get_rect(sprite)
+        if self.spatial_index is not None:
+            return self.spatial_index.get_rect(sprite)
+        return sprite.rect
+
+    @profiled('GameGroup.draw')
+    def draw(self, surface, area=None):
+        """Draws the sprites that overlap the surface, or only the given area of
+        it, when one is passed in surface coordinates."""
+        if area is None:
+            area = surface.get_rect()
+        visible_area = area.move(self.offset.x, self.offset.y)
+        live_sprites = self.visible_sprites(visible_area)
+        baked_count = 0
+        if self.static_layer is not None:
+            self.static_layer.draw(surface, visible_area, self.offset)
+            baked_count = len(self.static_layer)
+        # Every sprite is blitted in a single call, in depth order, along with
+        # the baked objects that need redrawing in front of them.
+        get_blit = self.get_blit
+        blits = []
+        for sprite in live_sprites:
+            offset = (sprite.rect.x - self.offset.x, sprite.rect.y - self.offset.y)
+            blits.append(get_blit(sprite.image, offset))
+            if self.static_layer is not None:
+                blits.extend(self.static_layer.get_blits_in_front_of(
+                    sprite, self.depth_keys[sprite], self.offset, get_blit
+                ))
+        surface.blits(blits, doreturn=False)
+        self.drawn_count = len(live_sprites)
+        if self.static_layer is not None:
+            profiler.count('blits', self.static_layer.chunks_drawn)
+        profiler.count('blits', len(blits))
+        self.baked_count = baked_count
+        # Group.__len__ would list every sprite just to count them
+        self.culled_count = len(self.spritedict) - baked_count - self.drawn_count
+
+    def get_blit(self, image, dest, area=None):
+        """Returns the arguments to blit an image with, taking it from the
+        group's atlas if it's in there."""
+        if self.atlas is not None:
+            return self.atlas.get_blit(image, dest, area)
+        return (image, dest, area)
+
+    def visible_sprites(self, area):
+        """Returns the sprites that overlap the given world-space area, sorted
+        for drawing. Sprites baked into the static layer are drawn with it,
+        so they're left out."""
+        if self.spatial_index is not None:
+            # Only groups indexed on the renderer rect can be culled through
+            # the index, since that's the rect the sprites are drawn at.
+            if self.indexed_rect == 'renderer':
+                visible = set(self.spatial_index.collide(area))
+                # Sprites whose bottom edge is above the area can't overlap
+                # it, so the walk down the depth order starts past them, and
+                # stops once it has come across every visible sprite.
+                self.sort_entries()
+                ordered = []
+                if not visible:
+                    return ordered
+                for _, _, sprite in self.depth_order.irange((area.top, float('inf'))):
+                    if sprite in visible:
+                        ordered.append(sprite)
+                        if len(ordered) == len(visible):
+                            break
+                return ordered
+        return [
+            sprite for sprite in self.sprites_by_bottom_edge_height()
+            if sprite.rect.colliderect(area)
+        ]
 
     def scroll(self, x, y):
         self.offset += Vector(x, y)
 
     def sprites_by_bottom_edge_height(self):
-        return sorted(self.sprites(), key=lambda x: x.rect.bottom)
+        self.sort_entries()
+        return [entry[2] for entry in self.depth_order]
 
 
 class VectorIterator():
@@ -70,23 +253,43 @@ class GameObject(pygame.sprite.Sprite):
     image = None
     fallback_image_size = (128, 128)
     fallback_image_color = (255, 255, 255)
-    # A set of offsets by which to adjust the sprite's rect in
-    # various situations. For example, collisions for various circumstances
-    # might be calculated at different locations on the sprite.
+    # A set of rects, offset from the sprite's origin, to use in various
+    # situations. For example, collisions for various circumstances might be
+    # calculated at different locations on the sprite.
     default_rect_options = dict()
     spritesheet = spritesheet_frame_map = animations = None
     available_interactions = set()
     # number of pixels of the sprite that account for the 'ground' it's standing on
     base_height = None
 
-    can_move = False
-    can_interact = False
+    # Components the object needs on top of the ones its other attributes
+    # call for; see get_components.
+    extra_components = frozenset()
+    # The rect option the object bumps into things with
+    collider_rect = 'collider'
+    # For objects with a velocity, in pixels per second per axis
+    SPEED = 0
+    # Whether the object may be pre-rendered into the static layer when it
+    # never moves or changes. Baked objects are still drawn in front of and
+    # behind moving objects correctly; set this to False for objects that
+    # need to be drawn on their own anyway.
+    bakeable = True
+    # Whether the object stays loaded the whole time a streamed level is
+    # played, rather than only while its region is near the camera.
+    stream_persistent = False
+
+    # Shared by every object, since objects of the same class tend to compile
+    # the same images.
+    compiled_images = CompiledImageCache()
 
     def __init__(self, startx, starty):
         super().__init__()
 
         self.animator = None
         self.children = GameGroup()
+        # The ComponentStore holding the object's per-frame state, if any
+        self.store = None
+        self.row = None
         if self.spritesheet:
             self.animator = Animator(
                 self.animations,
@@ -99,32 +302,125 @@ class GameObject(pygame.sprite.Sprite):
 
         if not self.image:
             self.image = self.get_fallback_image()
+        # The image of the object itself, before any children are drawn on it
+        self.base_image = self.image
 
-        self.rect = pygame.Rect((startx, starty), self.image.get_size())
+        width, height = self.image.get_size()
         self.rect_options = self.default_rect_options.copy()
-        self.current_rect = 'renderer'
         if 'renderer' not in self.rect_options:
-            self.rect_options['renderer'] = pygame.Rect((0, 0), self.rect.size)
+            self.rect_options['renderer'] = pygame.Rect(0, 0, width, height)
         if 'base' not in self.rect_options:
-            self.rect_options['base'] = pygame.Rect((0, 0), self.rect.size)
+            self.rect_options['base'] = pygame.Rect(0, 0, width, height)
         if 'collider' not in self.rect_options:
             coll_h = self.base_height
             if not coll_h:
-                coll_h = (self.rect.height * 1) // 4
+                coll_h = (height * 1) // 4
             self.rect_options['collider'] = pygame.Rect(
-                (0, self.rect.height - coll_h),
-                (self.rect.width, coll_h)
+                (0, height - coll_h),
+                (width, coll_h)
             )
 
+        # Where each rect option lies in the world. These are only updated
+        # when the object moves, so they can be read directly at any time.
+        self.origin = (int(startx), int(starty))
+        self.world_rects = {
+            name: option.move(self.origin)
+            for name, option in self.rect_options.items()
+        }
+        # The rect the sprite is drawn at
+        self.rect = self.world_rects['renderer']
+        # Whether the rects changed since the groups we're in last indexed
+        # them. Objects that only showed a new frame needn't be reindexed.
+        self.needs_reindex = False
+
+    @classmethod
+    def optimize_class_images(cls):
+        """Converts the surfaces set as the image of this class and its
+        subclasses to the display's pixel format. A LazyImage converts itself
+        instead. Objects made beforehand keep the old images."""
+        image = vars(cls).get('image')
+        if isinstance(image, pygame.Surface):
+            cls.image = optimize_surface(image)
+        for subclass in cls.__subclasses__():
+            subclass.optimize_class_images()
+
+    def get_components(self):
+        """Returns the components the object's state is made up of, which
+        decide what it can do."""
+        components = { ComponentStore.POSITION, ComponentStore.COLLIDER }
+        if self.animator:
+            components.add(ComponentStore.ANIMATION)
+        return components | self.extra_components
+
+    def is_dynamic(self):
+        """Whether the object changes from frame to frame, and so needs to be
+        updated."""
+        components = self.get_components()
+        return (
+            ComponentStore.VELOCITY in components or
+            ComponentStore.ANIMATION in components
+        )
+
+    def has_own_update(self):
+        """Whether updating the object does anything its ComponentStore's
+        systems don't already: it has logic of its own, children to step, or
+        no store to be stepped by."""
+        return (
+            self.store is None or
+            bool(self.children) or
+            type(self).update is not GameObject.update
+        )
+
+    def is_obstacle(self):
+        """Whether moving objects bump into this one. Only objects that stay
+        put are obstacles."""
+        components = self.get_components()
+        return (
+            ComponentStore.COLLIDER in components and
+            ComponentStore.VELOCITY not in components
+        )
+
+    def is_interactable(self):
+        return len(self.available_interactions) > 0
+
+    def is_bakeable(self):
+        """Whether the object can be pre-rendered into the static layer, which
+        requires that it never moves or changes its image."""
+        return self.bakeable and not self.is_dynamic() and not self.children
+
+    def attach(self, store):
+        """Moves the object's per-frame state into a ComponentStore, whose
+        systems then update it along with the store's other entities."""
+        components = self.get_components()
+        self.row = store.add(
+            self,
+            components,
+            position = self.get_origin(),
+            collider = tuple(self.rect_options[self.collider_rect]),
+            speed = self.SPEED
+        )
+        self.store = store
+        if self.animator:
+            self.animator.bind(store, self.row)
+
+    def detach(self):
+        """Takes the object's state back out of its ComponentStore."""
+        if self.store is None:
+            return
+        if self.animator:
+            self.animator.unbind()
+        self.store.remove(self)
+        self.store = self.row = None
+
     def get_render_bounding_box(self):
         """
         Returns a Rect whose location and size is adjusted to contain the base
         sprite and all of its children.
         """
         most_top = 0
-        most_bottom = self.rect.height
+        most_bottom = self.rect_options['base'].height
         most_left = 0
-        most_right = self.rect.width
+        most_right = self.rect_options['base'].width
 
         for child in self.children.sprites():
             crect = child.rect
@@ -144,65 +440,158 @@ class GameObject(pygame.sprite.Sprite):
 
     def prepare_for_render(self):
         bounding_box = self.get_render_bounding_box()
-        self.rect_options['renderer'] = bounding_box
+        if bounding_box != self.rect_options['renderer']:
+            self.set_rect_option('renderer', bounding_box)
+
+        if not self.children:
+            # There's nothing to compile, so the base image is drawn as is.
+            self.image = self.base_image
+            return
+
+        # The compiled image only changes when the base image, or the image or
+        # location of a child changes, so we reuse it for as long as possible.
+        children = self.children.sprites_by_bottom_edge_height()
+        cache_key = (self.base_image, tuple(bounding_box)) + tuple(
+            (child.image, child.rect.topleft) for child in children
+        )
+        compiled_image = self.compiled_images.get(cache_key)
+        if compiled_image is None:
+            compiled_image = self.compile_image(bounding_box, children)
+            self.compiled_images.put(cache_key, compiled_image)
 
-        # Compile the images of the base object and the child objects into one
-        # single image.
+        # Set up the sprite so it's ready to be drawn to the screen.
+        self.image = compiled_image
+
+    def compile_image(self, bounding_box, children):
+        """Compiles the images of the base object and the child objects into one
+        single image."""
         # Start by creating a transparent canvas the size of the bounding box.
         compiled_image = pygame.Surface(bounding_box.size, flags=pygame.SRCALPHA)
+        profiler.count('surfaces_allocated')
         compiled_image.fill((0,0,0,0))
         # Then draw the base image. Note that the location of the bounding box
         # will be relative to the location of the base object, so we draw the
         # base image at an offset so that it is effectively rendered at (0,0).
-        compiled_image.blit(self.image, (-bounding_box.x, -bounding_box.y))
-        # We can use the scroll feature of GameGroup to draw the child objects
-        # at an offset, as well.
-        sprites_to_compile = self.children.copy()
-        sprites_to_compile.scroll(*bounding_box.topleft)
-        sprites_to_compile.draw(compiled_image)
-
-        # Set up the sprite so it's ready to be drawn to the screen.
-        self.image = compiled_image
-        self.select_rect('renderer')
+        compiled_image.blit(self.base_image, (-bounding_box.x, -bounding_box.y))
+        # The child objects are drawn at the same offset, in depth order.
+        for child in children:
+            offset = (child.rect.x - bounding_box.x, child.rect.y - bounding_box.y)
+            compiled_image.blit(child.image, offset)
+        return compiled_image
 
     def update(self, gamestate):
-        self.select_rect('base')
-        if self.animator:
-            self.image = self.animator.advance_animation(gamestate.step_delta)
+        if self.store is None and self.animator:
+            self.animator.advance_animation(gamestate.step_delta)
         self.children.update(gamestate)
+        if self.store is None:
+            # Objects outside of a ComponentStore, such as children, aren't
+            # stepped by its systems, so they're already done.
+            self.refresh()
+        elif self.children:
+            # The store can't tell whether any of the children changed
+            self.store.mark_changed(self.row)
+
+    def refresh(self):
+        """Brings the object's rect and image up to date with its state, once
+        it's been stepped."""
+        if self.store is not None:
+            x, y = self.store.positions[self.row]
+            self.move_origin_to(int(x), int(y))
+        if self.animator:
+            self.base_image = self.animator.get_current_frame()
         self.prepare_for_render()
+        if self.needs_reindex:
+            self.reindex()
+
+    def reindex(self):
+        """Lets any spatially indexed groups we belong to know that we may
+        have moved."""
+        self.needs_reindex = False
+        for group in self.groups():
+            if isinstance(group, GameGroup):
+                group.reindex(self)
+
+    def release_assets(self):
+        """Gives up any shared assets held by this object and its children."""
+        if self.animator:
+            self.animator.release()
+        for child in self.children:
+            child.release_assets()
 
     def get_fallback_image(self):
         fallback_image = pygame.Surface(self.fallback_image_size)
+        profiler.count('surfaces_allocated')
         fallback_image.fill(self.fallback_image_color)
-        return fallback_image
+        return optimize_surface(fallback_image)
+
+    def set_rect_option(self, name, rect):
+        """Changes the offset and size of one of the rect options."""
+        self.rect_options[name] = rect
+        self.needs_reindex = True
+        if name in self.world_rects:
+            # Updated in place, since the renderer's world rect is our rect
+            self.world_rects[name].update(rect.move(self.origin))
+        else:
+            self.world_rects[name] = rect.move(self.origin)
 
-    def select_rect(self, target):
-        """Chooses which rectangle to assign the sprite."""
-        if target == self.current_rect:
-            pass
+    def get_origin(self):
+        """Returns where the object lies in the world, which is where its rect
+        options are offset from."""
+        return self.origin
+
+    def move_origin_to(self, x, y):
+        if (x, y) == self.origin:
+            return
+        self.origin = (x, y)
+        self.needs_reindex = True
+        for name, option in self.rect_options.items():
+            self.world_rects[name].topleft = (x + option.x, y + option.y)
+
+    def get_velocity(self):
+        """Returns how far, in pixels, the object moved during the last step."""
+        if self.store is None:
+            return (0, 0)
+        velocity_x, velocity_y = self.store.velocities[self.row]
+        return (float(velocity_x), float(velocity_y))
+
+    def set_velocity(self, x, y):
+        if self.store is None:
+            raise ValueError("Only objects in a ComponentStore can move.")
+        self.store.velocities[self.row] = (x, y)
+
+    def get_collider(self):
+        """Returns the world-space rect the object bumps into things with."""
+        if self.store is None:
+            return self.get_world_rect(self.collider_rect).copy()
+        return pygame.Rect(*self.store.colliders[self.row])
+
+    def move_collider_to(self, x, y):
+        """Moves the object so that its collider's top left corner lies at the
+        given world-space location."""
+        offset = self.rect_options[self.collider_rect]
+        if self.store is None:
+            self.move_origin_to(x - offset.x, y - offset.y)
+            return
+        position = (x - offset.x, y - offset.y)
+        if tuple(self.store.positions[self.row]) != position:
+            self.store.positions[self.row] = position
+            self.store.update_colliders([self.row])
+            self.store.mark_changed(self.row)
 
-        new_offset = self.rect_options[target]
-        current_offset = self.rect_options[self.current_rect]
-        # undo current offset
-        self.rect.x -= current_offset.x
-        self.rect.y -= current_offset.y
-        # add the target offset
-        self.rect.x += new_offset.x
-        self.rect.y += new_offset.y
-        self.rect.size = new_offset.size
-        self.current_rect = target
+    def get_world_rect(self, name):
+        """Returns where the given rect option lies in the world. The rect is
+        kept up to date as the object moves, so it mustn't be changed."""
+        return self.world_rects[name]
 
 
 class Wall(GameObject):
-    image = pygame.image.load(get_asset_path("Tree.png"))
+    image = LazyImage(get_asset_path("Tree.png"))
 
 
 # TODO: factor out the talking logic into a sort of cutscene generator component
 class Sign(GameObject):
-    image = pygame.image.load(get_asset_path("Hidden Bush.png"))
+    image = LazyImage(get_asset_path("Hidden Bush.png"))
     default_dialogue = get_asset_path('fallback_dialogue.xml')
-    can_interact = True
     available_interactions = { constants.INTERACTION_CHAT }
 
     def __init__(self, startx, starty, dialoguefile=None):
@@ -210,9 +599,13 @@ class Sign(GameObject):
 
         if not dialoguefile:
             dialoguefile = self.default_dialogue
-        self.chatbox = TextBox(pagefile=dialoguefile)
+        self.dialoguefile = dialoguefile
+        self.chatbox = None
 
     def chat(self, gamestate):
+        # The dialogue isn't loaded until someone first talks to us.
+        if self.chatbox is None:
+            self.chatbox = TextBox(pagefile=self.dialoguefile)
         return self.chatbox
 
 
@@ -224,7 +617,6 @@ class KillFace(Sign):
         (0, 64, 64, 64)
     )
     animations = { 'alcoholism': [1, 2] }
-    can_move = True
 
 
 class Pointer(GameObject):
@@ -286,55 +678,59 @@ class Player(GameObject):
         # Used when walking into objects
         'foot_collider': pygame.Rect(18, 54, 28, 10)
     }
-    can_move = True
+    extra_components = frozenset({ ComponentStore.VELOCITY })
+    collider_rect = 'foot_collider'
+    stream_persistent = True
 
     def __init__(self, startx, starty):
         super().__init__(startx, starty)
 
         self.orientation = Directions.SOUTH
-        self.velocity = Vector(0, 0)
         self.chat_cooldown = 180
+        # The game time the last chat ended at
         self.last_chatted = 0
 
+    def control(self, gamestate):
+        """Steers the player in the direction of the movement keys being held.
+        The player is moved along with every other entity afterwards."""
+        self.store.directions[self.row] = self.get_direction(gamestate.pressed_keys)
+
     def update(self, gamestate):
-        self.calculate_velocity(gamestate.step_delta)
-        self.rect = self.rect.move(self.velocity.x, self.velocity.y)
-        self.set_orientation(self.velocity.x, self.velocity.y)
-        with gamestate.static_objects.select_rect('collider'):
-            self.collide_with(gamestate.static_objects)
-        if pygame.key.get_pressed()[self.CONTROLS['interact']]:
-            with gamestate.interactable_objects.select_rect('base'):
-                self.check_for_interactions(gamestate.interactable_objects)
+        self.set_orientation(*self.get_velocity())
+        # Both groups are spatially indexed on the rect each check needs, so
+        # there's no need to select those rects on every obstacle first.
+        self.collide_with(gamestate.static_objects)
+        if gamestate.pressed_keys[self.CONTROLS['interact']]:
+            self.check_for_interactions(gamestate.interactable_objects, gamestate.time)
         self.select_animation()
 
         super().update(gamestate)
 
-    def can_chat(self):
-        return pygame.time.get_ticks() - self.last_chatted > self.chat_cooldown
+    def can_chat(self, time):
+        """Whether the cooldown since the last chat is over at the given game
+        time."""
+        return time - self.last_chatted > self.chat_cooldown
 
-    def calculate_velocity(self, ms_delta):
-        pressed_keys = pygame.key.get_pressed()
-        x_velocity, y_velocity = 0, 0
+    def get_direction(self, pressed_keys):
+        """Returns the direction the movement keys being held point in, with
+        each axis being -1, 0 or 1."""
+        x_direction, y_direction = 0, 0
         if pressed_keys[self.CONTROLS['left']]:
-            x_velocity -= self.SPEED
+            x_direction -= 1
         if pressed_keys[self.CONTROLS['right']]:
-            x_velocity += self.SPEED
+            x_direction += 1
         if pressed_keys[self.CONTROLS['up']]:
-            y_velocity -= self.SPEED
+            y_direction -= 1
         if pressed_keys[self.CONTROLS['down']]:
-            y_velocity += self.SPEED
+            y_direction += 1
+        return (x_direction, y_direction)
 
-        self.velocity.x = (x_velocity * ms_delta) / 1000
-        self.velocity.y = (y_velocity * ms_delta) / 1000
-
-    def check_for_interactions(self, interactable):
-        if not self.can_chat():
+    def check_for_interactions(self, interactable, time):
+        if not self.can_chat(time):
             return
 
         interaction_rect = self.get_interaction_rect()
-        old_rect = self.rect
-        self.rect = interaction_rect
-        for gameobj in pygame.sprite.spritecollide(self, interactable, False):
+        for gameobj in interactable.collide(interaction_rect):
             if constants.INTERACTION_CHAT in gameobj.available_interactions:
                 interaction_event = pygame.event.Event(
                     constants.INTERACTION_CHAT,
@@ -342,66 +738,70 @@ class Player(GameObject):
                 )
                 pygame.event.post(interaction_event)
                 break
-        self.rect = old_rect
 
     def collide_with(self, obstacles):
         """Change position and velocity based on a group of sprites with which
         to collide. Note that the object colliding may be included in the group."""
-        self.select_rect('foot_collider')
+        collider = self.get_collider()
+        x_velocity, y_velocity = self.get_velocity()
         # Generate collisions
-        for bumped_obj in pygame.sprite.spritecollide(self, obstacles, False):
+        for bumped_obj in obstacles.collide(collider):
             if self == bumped_obj:
                 pass
-            brect = bumped_obj.rect
+            brect = obstacles.get_indexed_rect(bumped_obj)
             # Determine which side to consider collided
             bumped_side = None
-            if self.rect.centerx < brect.centerx:
-                hor_depth = self.rect.right - brect.left
-                if self.rect.centery < brect.centery:
-                    vert_depth = self.rect.bottom - brect.top
+            if collider.centerx < brect.centerx:
+                hor_depth = collider.right - brect.left
+                if collider.centery < brect.centery:
+                    vert_depth = collider.bottom - brect.top
                     if vert_depth > hor_depth:
                         bumped_side = Directions.RIGHT
                     else:
                         bumped_side = Directions.DOWN
-                else: # if self.rect.centery >= brect.centery
-                    vert_depth = brect.bottom - self.rect.top
+                else: # if collider.centery >= brect.centery
+                    vert_depth = brect.bottom - collider.top
                     if vert_depth > hor_depth:
                         bumped_side = Directions.RIGHT
                     else:
                         bumped_side = Directions.UP
-            elif self.rect.centerx > brect.centerx:
-                hor_depth = brect.right - self.rect.left
-                if self.rect.centery < brect.centery:
-                    vert_depth = self.rect.bottom - brect.top
+            elif collider.centerx > brect.centerx:
+                hor_depth = brect.right - collider.left
+                if collider.centery < brect.centery:
+                    vert_depth = collider.bottom - brect.top
                     if vert_depth > hor_depth:
                         bumped_side = Directions.LEFT
                     else:
                         bumped_side = Directions.DOWN
-                else: # if self.rect.centery >= brect.centery
-                    vert_depth = brect.bottom - self.rect.top
+                else: # if collider.centery >= brect.centery
+                    vert_depth = brect.bottom - collider.top
                     if vert_depth > hor_depth:
                         bumped_side = Directions.LEFT
                     else:
                         bumped_side = Directions.UP
-            else: # self.rect.centerx == brect.centerx
-                if self.rect.centery < brect.centery:
+            else: # collider.centerx == brect.centerx
+                if collider.centery < brect.centery:
                     bumped_side = Directions.DOWN
                 else:
                     bumped_side = Directions.UP
 
             # Adjust our location and velocity for the collision
             if bumped_side == Directions.UP or bumped_side == Directions.DOWN:
-                self.velocity.y = 0
+                y_velocity = 0
                 if bumped_side == Directions.UP:
-                    self.rect.top = brect.bottom
+                    collider.top = brect.bottom
                 else: 
-                    self.rect.bottom = brect.top
+                    collider.bottom = brect.top
             else: # if bumped_side in [Directions.LEFT, Directions.RIGHT]
-                self.velocity.x = 0
+                x_velocity = 0
                 if bumped_side == Directions.LEFT:
-                    self.rect.left = brect.right
+                    collider.left = brect.right
                 else: 
-                    self.rect.right = brect.left
+                    collider.right = brect.left
+
+        self.move_collider_to(*collider.topleft)
+        if self.store is not None:
+            self.set_velocity(x_velocity, y_velocity)
 
     def get_interaction_rect(self):
         """
@@ -409,19 +809,20 @@ class Player(GameObject):
         towards what they're facing.
         """
         interaction_rect = pygame.Rect(0,0,3,3)
+        center = self.get_collider().center
         if self.orientation == Directions.NORTH:
             interaction_rect.height = (self.INTERACTION_REACH * 2) // 3
-            interaction_rect.midbottom = self.rect.center
+            interaction_rect.midbottom = center
         elif self.orientation == Directions.SOUTH:
             # vertical reach is a little shorter, for illusion of 3D
             interaction_rect.height = (self.INTERACTION_REACH * 3) // 4
-            interaction_rect.midtop = self.rect.center
+            interaction_rect.midtop = center
         elif self.orientation == Directions.EAST or self.orientation == Directions.WEST:
             interaction_rect.width = self.INTERACTION_REACH
             if self.orientation == Directions.WEST:
-                interaction_rect.midright = self.rect.center
+                interaction_rect.midright = center
             else:
-                interaction_rect.midleft = self.rect.center
+                interaction_rect.midleft = center
         return interaction_rect
 
     def set_orientation(self, x_velocity, y_velocity):
@@ -440,7 +841,7 @@ class Player(GameObject):
         """Based on internal information on our state, tell the animator what
         it should be playing."""
         animation = None
-        x_velocity, y_velocity = self.velocity.x, self.velocity.y
+        x_velocity, y_velocity = self.get_velocity()
         if x_velocity == 0 and y_velocity == 0:
             if self.orientation == Directions.SOUTH:
                 animation = 'idling_down'
@@ -1,10 +1,317 @@
-import pygame
+import functools, json, mmap, numpy, os, pygame, struct, threading
 
 from pygame import freetype
 from xml.etree import ElementTree as ET
-from collections import deque
+from bisect import bisect_right
+from collections import deque, OrderedDict
 from itertools import count
 
+from .profiling import profiled, profiler
+
+
+# Colors tried, in order, as the colorkey of images converted to use one
+COLORKEY_CANDIDATES = ((255, 0, 255), (0, 255, 0), (1, 2, 3))
+# How the pixels of an image with per-pixel alpha can be drawn: without any
+# transparency, with a colorkey, or only with per-pixel alpha
+OPAQUE, COLORKEYED, TRANSLUCENT = range(3)
+
+
+@functools.lru_cache(maxsize=1)
+def get_alpha_format(display):
+    """Returns the bit size and masks convert_alpha gives surfaces while the
+    display is the given one. It takes making a surface to find out, so it's
+    only done once per display."""
+    reference = pygame.Surface((1, 1), flags=pygame.SRCALPHA).convert_alpha()
+    return reference.get_bitsize(), reference.get_masks()
+
+
+def is_display_format(surface):
+    """Whether a surface can be blitted to the display without converting
+    its pixels first."""
+    display = pygame.display.get_surface()
+    if display is None:
+        return False
+    if surface.get_flags() & pygame.SRCALPHA:
+        return (surface.get_bitsize(), surface.get_masks()) == get_alpha_format(display)
+    return (
+        surface.get_bitsize() == display.get_bitsize() and
+        surface.get_masks()[:3] == display.get_masks()[:3]
+    )
+
+
+def get_transparency(surface):
+    """
+    Looks through the alpha of an image with per-pixel alpha, and returns
+    how it can be drawn along with the colorkey to draw it with, if any.
+    Images whose pixels are all either opaque or fully transparent are
+    COLORKEYED, unless none of COLORKEY_CANDIDATES is free to use.
+    """
+    alphas = pygame.surfarray.array_alpha(surface)
+    if alphas.min() == 255:
+        return OPAQUE, None
+    if ((alphas != 0) & (alphas != 255)).any():
+        return TRANSLUCENT, None
+    opaque = pygame.surfarray.array3d(surface)[alphas == 255].astype(numpy.uint32)
+    used_colors = set((opaque[:, 0] << 16 | opaque[:, 1] << 8 | opaque[:, 2]).tolist())
+    colorkey = next((
+        color for color in COLORKEY_CANDIDATES
+        if (color[0] << 16 | color[1] << 8 | color[2]) not in used_colors
+    ), None)
+    if colorkey is None:
+        return TRANSLUCENT, None
+    return COLORKEYED, colorkey
+
+
+def optimize_surface(surface, transparency=None):
+    """
+    Returns a surface drawing the same as the given one, in the display's
+    pixel format. Images whose pixels are all either opaque or fully
+    transparent are drawn with a colorkey and RLE acceleration instead of
+    per-pixel alpha, and fully opaque ones without either. The surface is
+    returned as is if there's no display yet, or it's already converted.
+
+    If given, transparency is what get_transparency returns for the surface,
+    whose fully transparent pixels must then already have the colorkey's
+    color, so its pixels don't need looking through.
+    """
+    if pygame.display.get_surface() is None:
+        return surface
+    if not surface.get_flags() & pygame.SRCALPHA:
+        if is_display_format(surface):
+            return surface
+        converted = surface.convert()
+        if converted.get_colorkey() is not None:
+            converted.set_colorkey(converted.get_colorkey(), pygame.RLEACCEL)
+        return converted
+    kind, colorkey = transparency or get_transparency(surface)
+    if kind == OPAQUE:
+        return surface.convert()
+    if kind == TRANSLUCENT:
+        if is_display_format(surface):
+            return surface
+        return surface.convert_alpha()
+    converted = surface.convert()
+    if transparency is None:
+        pixels = pygame.surfarray.pixels3d(converted)
+        pixels[pygame.surfarray.array_alpha(surface) == 0] = colorkey
+        del pixels
+    converted.set_colorkey(colorkey, pygame.RLEACCEL)
+    return converted
+
+
+def find_slow_surfaces(surfaces):
+    """Takes (name, surface) pairs and returns the names of the surfaces
+    that aren't in the display's pixel format."""
+    return [name for name, surface in surfaces if not is_display_format(surface)]
+
+
+def write_baked_file(path, blob):
+    """Writes a baked asset to a temporary file first, then moves it in
+    place, so the game never reads a half-written one."""
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as bakedfile:
+        bakedfile.write(blob)
+    os.replace(temporary_path, path)
+
+
+class BakedImage():
+    """
+    The raw pixels of an image file, baked by python -m game.bake into a file
+    next to it, so the image can be loaded without decoding it. A baked
+    image is only used while it's up to date with the file it came from.
+
+    Baked images are loaded by mapping the file into memory and drawing
+    straight from it, so every process loading the same image shares its
+    pages. The pixels are stored in the byte order of SDL's usual per-pixel
+    alpha format, so they can be blitted without being converted first.
+
+    The image's transparency is worked out while baking, and its fully
+    transparent pixels given the colorkey's color if it has one, so that
+    optimize_surface can convert it without looking through its pixels.
+    """
+
+    MAGIC = b'PXLC'
+    VERSION = 3
+    EXTENSION = '.pxlc'
+    # magic, version, source mtime in ns, source size, width, height, format,
+    # transparency, colorkey
+    HEADER = struct.Struct('<4sHxxqqII4sB3s')
+    PIXEL_FORMAT = 'BGRA'
+
+    @classmethod
+    def read_header(cls, blob, path):
+        """Returns the width, height, pixel format and transparency of a
+        baked image, or None if it isn't one this version can read that's up
+        to date with the image file at path."""
+        if len(blob) < cls.HEADER.size:
+            return None
+        (
+            magic, version, mtime, size, width, height, pixel_format,
+            kind, colorkey
+        ) = cls.HEADER.unpack_from(blob)
+        stat = os.stat(path)
+        if (
+            magic != cls.MAGIC or version != cls.VERSION or
+            (mtime, size) != (stat.st_mtime_ns, stat.st_size)
+        ):
+            return None
+        transparency = (kind, tuple(colorkey) if kind == COLORKEYED else None)
+        return width, height, pixel_format.decode(), transparency
+
+    @classmethod
+    def load(cls, path):
+        """Returns the image baked from the file at path and its transparency,
+        as get_transparency would find it, or None if there's no baked image
+        that's up to date with the file. The image keeps the file mapped for
+        as long as it's around."""
+        try:
+            with open(path + cls.EXTENSION, 'rb') as bakedfile:
+                # Mapped copy-on-write, so drawing onto the image can't change
+                # the file, and only copies the pages drawn onto
+                mapping = mmap.mmap(bakedfile.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            # Empty files can't be mapped, and raise ValueError
+            return None
+        header = cls.read_header(mapping, path)
+        pixels = memoryview(mapping)[cls.HEADER.size:]
+        if header is None or len(pixels) != header[0] * header[1] * len(header[2]):
+            pixels.release()
+            mapping.close()
+            return None
+        width, height, pixel_format, transparency = header
+        return pygame.image.frombuffer(pixels, (width, height), pixel_format), transparency
+
+    @classmethod
+    def is_up_to_date(cls, path):
+        try:
+            with open(path + cls.EXTENSION, 'rb') as bakedfile:
+                blob = bakedfile.read(cls.HEADER.size)
+        except OSError:
+            return False
+        return cls.read_header(blob, path) is not None
+
+    @classmethod
+    def bake(cls, path):
+        stat = os.stat(path)
+        source = pygame.image.load(path)
+        # Drawn onto per-pixel alpha, which any colorkey the file has carries
+        # over to
+        image = pygame.Surface(source.get_size(), flags=pygame.SRCALPHA)
+        image.fill((0, 0, 0, 0))
+        image.blit(source, (0, 0))
+        kind, colorkey = get_transparency(image)
+        if kind == COLORKEYED:
+            pixels = pygame.surfarray.pixels3d(image)
+            pixels[pygame.surfarray.array_alpha(image) == 0] = colorkey
+            del pixels
+        header = cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, stat.st_mtime_ns, stat.st_size,
+            image.get_width(), image.get_height(), cls.PIXEL_FORMAT.encode(),
+            kind, bytes(colorkey or (0, 0, 0))
+        )
+        pixels = pygame.image.tobytes(image, cls.PIXEL_FORMAT)
+        write_baked_file(path + cls.EXTENSION, header + pixels)
+
+
+def load_image(path, optimize=False):
+    """Loads an image file, from its baked pixels if they're up to date. If
+    optimize is set, the image is run through optimize_surface too, which
+    can use the transparency found while baking."""
+    baked = BakedImage.load(path)
+    if baked is None:
+        image, transparency = pygame.image.load(path), None
+    else:
+        image, transparency = baked
+    if optimize:
+        image = optimize_surface(image, transparency)
+    return image
+
+
+class LazyImage():
+    """
+    An image set on a class that's only loaded from its file the first time
+    it's used, rather than when the class is defined, so importing the class
+    stays cheap. Once there's a display, the image is converted to its pixel
+    format.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.image = None
+        self.optimized = False
+        self.lock = threading.Lock()
+
+    def __get__(self, instance, owner=None):
+        if self.image is None or not self.optimized:
+            self.load()
+        return self.image
+
+    def load(self):
+        # Levels may be built on a worker thread, which shouldn't end up
+        # with an image of its own.
+        with self.lock:
+            has_display = pygame.display.get_surface() is not None
+            if self.image is None:
+                self.image = load_image(self.path, optimize=has_display)
+                self.optimized = has_display
+            elif not self.optimized and has_display:
+                self.image = optimize_surface(self.image)
+                self.optimized = True
+
+
+class AssetRegistry():
+    """
+    Holds on to decoded assets so that everything asking for the same asset
+    shares one copy of it. Each asset is reference counted, so that the ones
+    nothing uses anymore can be evicted, for instance when a level unloads.
+    Levels may be built on a worker thread while the main thread evicts, so
+    every method holds the registry's lock.
+    """
+
+    def __init__(self):
+        self.assets = dict()
+        self.reference_counts = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.assets)
+
+    def __contains__(self, key):
+        return key in self.assets
+
+    def items(self):
+        """Returns a list of the stored keys and assets."""
+        with self.lock:
+            return list(self.assets.items())
+
+    def acquire(self, key, load):
+        """Returns the asset stored under the key, calling load to decode it
+        first if it isn't stored yet."""
+        with self.lock:
+            if key not in self.assets:
+                self.assets[key] = load()
+                self.reference_counts[key] = 0
+            self.reference_counts[key] += 1
+            return self.assets[key]
+
+    def release(self, key):
+        with self.lock:
+            if self.reference_counts.get(key, 0) > 0:
+                self.reference_counts[key] -= 1
+
+    def evict_unreferenced(self):
+        """Drops every asset that nothing holds a reference to. Returns how
+        many were dropped."""
+        with self.lock:
+            unreferenced = [
+                key for key, references in self.reference_counts.items()
+                if references == 0
+            ]
+            for key in unreferenced:
+                del self.assets[key]
+                del self.reference_counts[key]
+            return len(unreferenced)
+
 
 # TODO: add support for static and dynamic overlays, which are just sprites or
 #       images to render on top of the current sprite
@@ -13,16 +320,48 @@ class Animator():
 
     default_frame_timestep = 100
     default_sprite_size = (32, 32)
+    # Decoded spritesheets and frames, shared by every Animator made from the
+    # same sheets, frame map and animations.
+    registry = AssetRegistry()
 
     def __init__(self, animations, spritesheets=[], frame_map=[]):
         if len(frame_map) > 0 and len(spritesheets) == 0:
             raise ValueError("Cannot provide a frame map without a spritesheet.")
-        # Load and optimize spritesheets for fast blitting
-        self.spritesheets = []
+        self.asset_key = self.make_asset_key(animations, spritesheets, frame_map)
+        self.spritesheets, self.animations = self.registry.acquire(
+            self.asset_key,
+            lambda: self.decode(animations, spritesheets, frame_map)
+        )
+
+        self.current_animation = None
+        # While bound to a row of a ComponentStore, the clock is kept on one
+        # of its timelines, which the store advances along with every other.
+        self.store = None
+        self.row = None
+        self._time_elapsed = 0
+
+    def make_asset_key(self, animations, spritesheets, frame_map):
+        """Returns a hashable key describing everything decode depends on."""
+        return (
+            tuple(spritesheets),
+            tuple(tuple(mapping) for mapping in frame_map),
+            tuple((name, tuple(frames)) for name, frames in animations.items()),
+            tuple(self.default_sprite_size)
+        )
+
+    def decode(self, animations, spritesheets, frame_map):
+        """Loads the spritesheets, cuts them into frames and resolves the frame
+        numbers of each animation. Returns the sheets and the animations."""
+        # Load and optimize spritesheets for fast blitting. Baked sheets are
+        # usually in the display's format already, and are kept as they are
+        # so they stay shared with other processes.
+        loaded_sheets = []
         for sheet in spritesheets:
             if type(sheet) == str:
-                sheet = pygame.image.load(sheet)
-            self.spritesheets.append(sheet.convert_alpha())
+                sheet = load_image(sheet)
+            if not (sheet.get_flags() & pygame.SRCALPHA and is_display_format(sheet)):
+                sheet = sheet.convert_alpha()
+            loaded_sheets.append(sheet)
         frames = []
         for mapping in frame_map:
             # Create a rect representing the location of the sprite for the frame
@@ -38,17 +377,17 @@ class Animator():
                 sheet_index = mapping[4] - 1
             elif len(mapping) == 3:
                 sheet_index = mapping[2] - 1
-            if sheet_index >= len(self.spritesheets):
+            if sheet_index >= len(loaded_sheets):
                 error_mesg = "Requested a sprite from sheet {}, " + \
                 "but only {} sheets were found"
-                error_mesg = error_mesg.format(sheet_index + 1, len(self.spritesheets))
+                error_mesg = error_mesg.format(sheet_index + 1, len(loaded_sheets))
                 raise ValueError(error_mesg)
 
             # Cut the frame
-            frame = self.spritesheets[sheet_index].subsurface(sprite_offset)
+            frame = loaded_sheets[sheet_index].subsurface(sprite_offset)
             frames.append(frame)
 
-        self.animations = dict()
+        decoded_animations = dict()
         for animation_name, encoded_frames in animations.items():
             decoded_frames = []
             for eframe in encoded_frames:
@@ -56,10 +395,51 @@ class Animator():
                 if type(eframe) == int:
                     decoded_frame = frames[eframe - 1]
                 decoded_frames.append(decoded_frame)
-            self.animations[animation_name] = decoded_frames
+            decoded_animations[animation_name] = decoded_frames
+        return loaded_sheets, decoded_animations
 
-        self.current_animation = None
-        self.time_elapsed = 0
+    def release(self):
+        """Gives up this Animator's reference to its shared frames."""
+        if self.asset_key is not None:
+            self.registry.release(self.asset_key)
+            self.asset_key = None
+
+    @property
+    def time_elapsed(self):
+        if self.store is None:
+            return self._time_elapsed
+        return self.store.get_animation_clock(self.row)
+
+    @time_elapsed.setter
+    def time_elapsed(self, ms):
+        if self.store is None:
+            self._time_elapsed = ms
+        else:
+            self.store.start_animation(
+                self.row,
+                (self.asset_key, self.current_animation),
+                self.get_animation_length(),
+                self.default_frame_timestep,
+                ms
+            )
+
+    def bind(self, store, row):
+        """Moves the animation clock into a row of a ComponentStore. The
+        animation must already be playing."""
+        time_elapsed = self.time_elapsed
+        self.store, self.row = store, row
+        self.time_elapsed = time_elapsed
+
+    def unbind(self):
+        """Takes the animation clock back out of its ComponentStore."""
+        time_elapsed = self.time_elapsed
+        self.store.leave_timeline(self.row)
+        self.store = self.row = None
+        self.time_elapsed = time_elapsed
+
+    def get_animation_length(self):
+        """Returns how many milliseconds the current animation lasts."""
+        return len(self.animations[self.current_animation]) * self.default_frame_timestep
 
     def play(self, animation, reset=True):
         """Begin playing an animation."""
@@ -69,8 +449,8 @@ class Animator():
         # unless the current animation was played with the reset flag set to False,
         # we should start playing the requested animation from the beginning
         if not (self.current_animation == animation and not reset):
+            self.current_animation = animation
             self.time_elapsed = 0
-        self.current_animation = animation
         return self.get_current_frame()
 
     def get_current_frame(self):
@@ -78,12 +458,295 @@ class Animator():
         return self.animations[self.current_animation][frame_number]
 
     def advance_animation(self, ms):
-        total_animation_time = len(self.animations[self.current_animation]) * self.default_frame_timestep
-        self.time_elapsed = (self.time_elapsed + ms) % total_animation_time
+        self.time_elapsed = (self.time_elapsed + ms) % self.get_animation_length()
         return self.get_current_frame()
 
 
+class CompiledImageCache():
+    """
+    A bounded store of images compiled from a base image and the images of its
+    children, keyed on everything that went into compiling them. The least
+    recently used images are dropped once the cache is full.
+    """
+
+    DEFAULT_MAX_SIZE = 256
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        self.images[key] = image
+        self.images.move_to_end(key)
+        while len(self.images) > self.max_size:
+            self.images.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def clear(self):
+        self.images.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class TextureAtlas():
+    """
+    Copies a set of images into a few large pages, so that drawing any of them
+    blits a region of one of a handful of surfaces. Images are packed in rows
+    from the tallest down; any too large to fit on a page are left out, and
+    are drawn from their own surface as before.
+
+    Pages have per-pixel alpha, so only images drawn with per-pixel alpha
+    are packed. Opaque and colorkeyed images blit several times faster from
+    their own surfaces, which can be copied as is or run-length encoded.
+    """
+
+    PAGE_SIZE = (1024, 1024)
+    # Space left around each image, so regions never bleed into each other
+    PADDING = 1
+
+    def __init__(self, images=(), page_size=None):
+        self.page_size = page_size or self.PAGE_SIZE
+        self.pages = []
+        # Maps each packed image to its page and the area it's copied to
+        self.regions = dict()
+        self.pack(images)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __contains__(self, image):
+        return image in self.regions
+
+    @classmethod
+    def from_gameobjects(cls, gameobjects, page_size=None):
+        """Builds an atlas of every frame and standalone image the objects
+        may be drawn with."""
+        images = dict()
+        for gameobject in gameobjects:
+            if gameobject.animator:
+                for frames in gameobject.animator.animations.values():
+                    images.update(dict.fromkeys(frames))
+            elif not gameobject.children:
+                images[gameobject.base_image] = None
+        return cls(images, page_size)
+
+    @staticmethod
+    def is_packable(image):
+        return bool(image.get_flags() & pygame.SRCALPHA) and image.get_colorkey() is None
+
+    def pack(self, images):
+        page_width, page_height = self.page_size
+        placements = []
+        x = y = row_height = 0
+        pages_used = 0
+        unique_images = [
+            image for image in dict.fromkeys(images)
+            if image not in self.regions and self.is_packable(image)
+        ]
+        for image in sorted(unique_images, key=lambda image: -image.get_height()):
+            width, height = image.get_size()
+            if width > page_width or height > page_height:
+                continue
+            if x + width > page_width:
+                x, y, row_height = 0, y + row_height + self.PADDING, 0
+            if y + height > page_height or pages_used == 0:
+                x, y, row_height = 0, 0, 0
+                pages_used += 1
+            placements.append((image, pages_used - 1, pygame.Rect((x, y), (width, height))))
+            x += width + self.PADDING
+            row_height = max(row_height, height)
+
+        # Pages are only as tall as what's packed on them
+        heights = [0] * pages_used
+        for _, page, area in placements:
+            heights[page] = max(heights[page], area.bottom)
+        first_page = len(self.pages)
+        for height in heights:
+            page = pygame.Surface((page_width, height), flags=pygame.SRCALPHA).convert_alpha()
+            page.fill((0, 0, 0, 0))
+            profiler.count('surfaces_allocated')
+            self.pages.append(page)
+        for image, page, area in placements:
+            page = self.pages[first_page + page]
+            # Blitting onto fully transparent pixels copies the image as is
+            page.blit(image, area)
+            self.regions[image] = (page, area)
+
+    def get_blit(self, image, dest, area=None):
+        """Returns the (source, dest, area) arguments to blit an image, or the
+        given area of it, with, drawing from its page if it's in the atlas."""
+        region = self.regions.get(image)
+        if region is None:
+            return (image, dest, area)
+        page, image_area = region
+        if area is None:
+            return (page, dest, image_area)
+        return (page, dest, area.move(image_area.topleft).clip(image_area))
+
+
+class FontCache():
+    """Opens each font once per face, size and style, for everything that
+    renders text to share."""
+
+    def __init__(self):
+        self.fonts = dict()
+
+    def __len__(self):
+        return len(self.fonts)
+
+    def get(self, face='', size=14, style=freetype.STYLE_NORMAL):
+        key = (face, size, style)
+        if key not in self.fonts:
+            font = freetype.SysFont(face, size)
+            font.style = style
+            self.fonts[key] = font
+        return self.fonts[key]
+
+
+class DialogueGraph():
+    """
+    The pages of a dialogue file and the choices between them, as plain
+    lists that TextBoxPages are built from. Pages are referred to by number,
+    and the lists of pages that choices lead to are kept in a table of their
+    own, so choices leading on to the same pages share one list as they do in
+    the file.
+
+    Graphs are baked by python -m game.bake into a JSON file next to the
+    dialogue file, which is loaded instead of parsing the XML for as long as
+    it's up to date with the file.
+    """
+
+    VERSION = 1
+    EXTENSION = '.dlgc'
+
+    def __init__(self, pages=None, page_lists=None, root=None):
+        # Each page is [text, [[choice text, index of the page list], ...]]
+        self.pages = pages or []
+        self.page_lists = page_lists or []
+        # The index of the list of pages the dialogue starts with
+        self.root = root
+
+    @classmethod
+    def from_xml(cls, path):
+        # TODO: add support for adding attributes to each page
+        root = ET.parse(path).getroot()
+        assert root.tag == "DialogBox"
+        graph = cls()
+        graph.root = graph.add_pages(root.findall("Page"))
+        return graph
+
+    def add_pages(self, page_nodes):
+        """Adds the pages of a list of page nodes, and everything their
+        choices lead to. Returns the index of the new list of pages."""
+        page_ids = []
+        for page_node in page_nodes:
+            choices = []
+            terminal_choice_pages = page_node.findall("Page")
+            choice_nodes = page_node.findall("Choice")
+            # Pages following the choices are where every one of the choices
+            # leads, so they're added once and shared between all of them.
+            shared_choice_pages = None
+            if len(terminal_choice_pages) and len(choice_nodes):
+                shared_choice_pages = self.add_pages(terminal_choice_pages)
+            for choice_node in choice_nodes:
+                if shared_choice_pages is None:
+                    choice_pages = self.add_pages(choice_node.findall("Page"))
+                else:
+                    choice_pages = shared_choice_pages
+                choices.append([choice_node.text.strip(), choice_pages])
+            page_ids.append(len(self.pages))
+            self.pages.append([page_node.text.strip(), choices])
+        self.page_lists.append(page_ids)
+        return len(self.page_lists) - 1
+
+    def build(self):
+        """Creates the TextBoxPages, and returns the list the dialogue starts
+        with."""
+        pages = [None] * len(self.pages)
+        page_lists = []
+        # Lists are added after the lists their pages' choices lead to, so
+        # those are always built by the time a page needs them.
+        for page_ids in self.page_lists:
+            for page_id in page_ids:
+                text, choices = self.pages[page_id]
+                pages[page_id] = TextBoxPage(
+                    raw_text = text,
+                    choices = {
+                        choice_text: page_lists[choice_pages]
+                        for choice_text, choice_pages in choices
+                    }
+                )
+            page_lists.append([pages[page_id] for page_id in page_ids])
+        return page_lists[self.root]
+
+    @classmethod
+    def read_baked(cls, path):
+        """Returns the graph baked from the dialogue file at path, or None if
+        there's no baked graph that's up to date with the file."""
+        stat = os.stat(path)
+        try:
+            with open(path + cls.EXTENSION, 'r') as bakedfile:
+                data = json.load(bakedfile)
+            if (
+                data['version'] == cls.VERSION and
+                data['source_mtime_ns'] == stat.st_mtime_ns and
+                data['source_size'] == stat.st_size
+            ):
+                return cls(data['pages'], data['page_lists'], data['root'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @classmethod
+    def load(cls, path):
+        """Returns the graph of the dialogue file at path, from its baked copy
+        if that's up to date."""
+        graph = cls.read_baked(path)
+        if graph is None:
+            graph = cls.from_xml(path)
+        return graph
+
+    @classmethod
+    def is_up_to_date(cls, path):
+        return cls.read_baked(path) is not None
+
+    @classmethod
+    def bake(cls, path):
+        stat = os.stat(path)
+        graph = cls.from_xml(path)
+        data = {
+            'version': cls.VERSION,
+            'source_mtime_ns': stat.st_mtime_ns,
+            'source_size': stat.st_size,
+            'pages': graph.pages,
+            'page_lists': graph.page_lists,
+            'root': graph.root,
+        }
+        write_baked_file(path + cls.EXTENSION, json.dumps(data).encode('utf-8'))
+
+
 class TextBoxPage():
+    fonts = FontCache()
+
     def only_with_choices(func):
         def wrapper(self, *args, **kwargs):
             if len(self.choices):
@@ -98,31 +761,49 @@ class TextBoxPage():
         if raw_text != None:
             self.text = raw_text
         self.cps = characters_per_second
-        self.font = freetype.SysFont('', text_size)
+        self.font = self.fonts.get('', text_size)
         self.text_color = text_color
         self.line_separation = line_separation
         self.choices = choices
         self.choice_keys = list(self.choices.keys())
-        self.current_choice = 0 if len(self.choices) else None
-
-    @only_with_choices
-    def make_choice(self):
-        return self.choices[self.choice_keys[self.current_choice]]
+        self.layout = None
+        self.layout_bounds = None
 
-    @only_with_choices
-    def next_choice(self):
-        self.current_choice = (self.current_choice + 1) % len(self.choices)
+    def get_layout(self, bounds):
+        """
+        Returns where each word of the page's text goes within the bounds, as a
+        list of (index of the word's first character, word, location) tuples.
+        The layout is only worked out the first time it's asked for.
+        """
+        if self.layout is not None and self.layout_bounds == bounds:
+            return self.layout
+        x, y = bounds.topleft
+        space = self.font.get_rect(' ')
+        font_height = self.font.get_sized_height()
+        carriage_return = self.line_separation + font_height
+        self.layout = []
+        start = 0
+        for word in self.text.split(' '):
+            word_bounds = self.font.get_rect(word)
+            if word_bounds.width + word_bounds.x + x > bounds.right:
+                x, y = bounds.left, y + carriage_return
+            # TODO: cut off the text if it's too long
+            self.layout.append((start, word, (x, y)))
+            x += word_bounds.width + space.width
+            start += len(word) + 1
+        self.layout_bounds = bounds
+        return self.layout
 
     @only_with_choices
-    def prev_choice(self):
-        self.current_choice = (self.current_choice - 1) % len(self.choices)
+    def make_choice(self, choice):
+        return self.choices[self.choice_keys[choice]]
 
-    def draw_choices(self, surface):
+    def draw_choices(self, surface, current_choice):
         separation = surface.get_width() // (len(self.choice_keys) + 1)
         iterator = count(separation, separation)
         for choice_text, x, i in zip(self.choice_keys, iterator, count()):
             style = 0
-            if i == self.current_choice:
+            if i == current_choice:
                 style = (freetype.STYLE_STRONG | freetype.STYLE_UNDERLINE)
             text_rect = self.font.get_rect(choice_text, style=style)
             self.font.render_to(
@@ -137,6 +818,10 @@ class TextBox():
     LOCATION = (16, 192)
     RESTING_PERIOD = 200
     DEFAULT_MARGIN = (8, 8)
+    # Pages parsed from each dialogue file, shared by every TextBox reading
+    # that file. Maps the file's path to its modification time and its pages,
+    # so that edits to the file are picked up.
+    parsed_pagefiles = dict()
 
     def skip_if_resting(func):
         def wrapper(self, *args, **kwargs):
@@ -157,86 +842,118 @@ class TextBox():
         else:
             self.text_margin = text_margin
         self.background = pygame.Surface(self.SIZE)
+        profiler.count('surfaces_allocated')
+        # The text is rendered onto the background as it's revealed, so we keep
+        # track of what's already on there.
+        self.rendered_page = None
+        self.rendered_length = 0
+        self.rendered_choice = None
+        self.word_rects = dict()
+        # Pages can be shared between TextBoxes, so which choice is selected on
+        # each page is kept here rather than on the pages
+        self.choice_cursors = dict()
         self.choice_stack = deque()
         # if we enter a question branch without totally exploring the dialog
         # at the current depth, we record that depth here, for rebounding to
         self.rebound_depth = None
 
     def parse_pagefile(self, pagefile):
-        # TODO: add support for adding attributes to each page
-        root = ET.parse(pagefile).getroot()
-        assert root.tag == "DialogBox"
-        return self._enumerate_pages(root.findall("Page"))
-
-    def _enumerate_pages(self, page_nodes):
-        pages = []
-        for page_node in page_nodes:
-            choices = { }
-            terminal_choice_pages = page_node.findall("Page")
-            choice_nodes = page_node.findall("Choice")
-            for choice_node in choice_nodes:
-                if len(terminal_choice_pages) == 0:
-                    choice_pages = self._enumerate_pages(choice_node.findall("Page"))
-                else:
-                    choice_pages = self._enumerate_pages(terminal_choice_pages)
-                choices[choice_node.text.strip()] = choice_pages
-            page = TextBoxPage(
-                raw_text = page_node.text.strip(),
-                choices = choices
-            )
-            pages.append(page)
+        path = os.path.realpath(pagefile)
+        mtime = os.path.getmtime(path)
+        if path in self.parsed_pagefiles:
+            parsed_mtime, pages = self.parsed_pagefiles[path]
+            if parsed_mtime == mtime:
+                return pages
+        pages = DialogueGraph.load(path).build()
+        self.parsed_pagefiles[path] = (mtime, pages)
         return pages
 
     def update(self, gamestate):
         self.time_displaying_page += gamestate.step_delta
+        self.reveal_text()
+
+    def reveal_text(self):
+        """Works out how much of the current page's text should be showing."""
         page_text = self.get_page_text()
         cps = self.get_current_cps()
         render_end = (cps * self.time_displaying_page) // 1000
         render_end = min(len(page_text), render_end)
         self.text = page_text[0:render_end]
 
+    @profiled('TextBox.draw')
     def draw(self, display):
-        self.background.fill(self.BACKGROUND_COLOR)
+        page = self.pages[self.current_page]
+        if page is not self.rendered_page or len(self.text) < self.rendered_length:
+            self.clear_background(page)
         self.draw_choices_to_background()
         self.draw_text_to_background()
         display.blit(self.background, self.LOCATION)
+        profiler.count('blits')
+
+    def clear_background(self, page):
+        self.background.fill(self.BACKGROUND_COLOR)
+        self.rendered_page = page
+        self.rendered_length = 0
+        self.rendered_choice = None
+        self.word_rects.clear()
+
+    def get_text_bounds(self):
+        x, y = self.text_margin
+        return pygame.Rect(x, y, self.background.get_width() - (2 * x), self.background.get_height() - (2 * y))
 
     def draw_text_to_background(self):
+        """Renders the words revealed since the last time this was called."""
         # TODO: if the page has choices, make sure to stop early to leave space
+        if len(self.text) == self.rendered_length:
+            return
         page = self.pages[self.current_page]
-        x, y = self.text_margin
-        leftmost, rightmost = x, self.background.get_width() - x
-        bottommost = self.background.get_height() - y
-        space = page.font.get_rect(' ')
+        layout = page.get_layout(self.get_text_bounds())
+        starts = [start for start, word, location in layout]
+        first_word = max(0, bisect_right(starts, self.rendered_length) - 1)
+        last_word = bisect_right(starts, len(self.text))
+        for word_index in range(first_word, last_word):
+            self.draw_word_to_background(page, layout, word_index)
+        self.rendered_length = len(self.text)
+
+    def draw_word_to_background(self, page, layout, word_index):
+        """Renders as much of a word as has been revealed, over whatever part of
+        it was rendered before."""
+        start, word, (x, y) = layout[word_index]
+        if word_index in self.word_rects:
+            self.background.fill(self.BACKGROUND_COLOR, self.word_rects.pop(word_index))
+        revealed = self.text[start:start + len(word)]
+        if not revealed:
+            return
+        # TODO: based on the height of the text vs the font's actual height,
+        #       calculate how far down you should render it to align all the
+        #       words to a baseline, rather than having them top-aligned.
+        bounds = page.font.get_rect(revealed)
         font_height = page.font.get_sized_height()
-        carriage_return = page.line_separation + font_height
-        for word in self.text.split(' '):
-            bounds = page.font.get_rect(word)
-            if bounds.width + bounds.x + x > rightmost:
-                x, y = leftmost, y + carriage_return
-            # TODO: cut off the text if it's too long
-            # TODO: based on the height of the text vs the font's actual height,
-            #       calculate how far down you should render it to align all the
-            #       words to a baseline, rather than having them top-aligned.
-            page.font.render_to(
-                self.background, (x, y + (font_height - bounds.y)), None,
-                fgcolor=(page.text_color)
-            )
-            x += bounds.width + space.width
+        self.word_rects[word_index] = page.font.render_to(
+            self.background, (x, y + (font_height - bounds.y)), None,
+            fgcolor=(page.text_color)
+        )
 
     def draw_choices_to_background(self):
+        """Renders the page's choices, whenever the selected one changes."""
         page = self.pages[self.current_page]
-        if len(page.choices):
+        current_choice = self.get_current_choice()
+        if len(page.choices) and current_choice != self.rendered_choice:
             width = self.background.get_width() - (2 * self.text_margin[0])
             height = page.font.get_sized_height()
-            choice_box = pygame.Surface((width, height), flags=pygame.SRCALPHA)
-            choice_box.fill((0, 0, 0, 0))
-            page.draw_choices(choice_box)
             offset = (
                 self.text_margin[0],
                 self.background.get_height() - (self.text_margin[1] + height)
             )
-            self.background.blit(choice_box, offset)
+            choice_area = pygame.Rect(offset, (width, height))
+            self.background.fill(self.BACKGROUND_COLOR, choice_area)
+            page.draw_choices(self.background.subsurface(choice_area), current_choice)
+            self.rendered_choice = current_choice
+            # Text is drawn over the choices, so put back any we just covered.
+            layout = page.get_layout(self.get_text_bounds())
+            for word_index, rect in list(self.word_rects.items()):
+                if rect.colliderect(choice_area):
+                    self.draw_word_to_background(page, layout, word_index)
 
     def get_page_text(self):
         return self.pages[self.current_page].text
@@ -258,13 +975,16 @@ class TextBox():
             self.pages,
             self.rebound_depth
         ))
+        choice = self.get_current_choice()
         self.time_displaying_page = 0
         self.current_page = 0
-        self.pages = page.make_choice()
+        self.pages = page.make_choice(choice)
+        self.reveal_text()
 
     def unmake_choice(self):
         previous = self.choice_stack.pop()
         self.current_page, self.pages, self.rebound_depth = previous
+        self.reveal_text()
 
     def rebound(self):
         """
@@ -279,6 +999,7 @@ class TextBox():
             self.pages[self.current_page] # throw error if nonexistent page
             self.current_page = page_num
             self.time_displaying_page = 0
+            self.reveal_text()
 
     @skip_if_resting
     def next_page(self):
@@ -293,13 +1014,27 @@ class TextBox():
         if self.current_page > 0:
             self.goto_page(self.current_page - 1)
 
+    def get_current_choice(self):
+        """Returns the index of the choice selected on the current page, or None
+        if the page has no choices."""
+        page = self.pages[self.current_page]
+        if not len(page.choices):
+            return None
+        return self.choice_cursors.get(page, 0)
+
+    def move_choice_cursor(self, step):
+        page = self.pages[self.current_page]
+        if len(page.choices):
+            choice = (self.get_current_choice() + step) % len(page.choices)
+            self.choice_cursors[page] = choice
+
     @skip_if_resting
     def next_choice(self):
-        self.pages[self.current_page].next_choice()
+        self.move_choice_cursor(1)
 
     @skip_if_resting
     def prev_choice(self):
-        self.pages[self.current_page].prev_choice()
+        self.move_choice_cursor(-1)
 
     def show_full_page(self):
         cps = self.get_current_cps()
@@ -325,3 +1060,80 @@ class TextBox():
     def is_choosing(self):
         page = self.pages[self.current_page]
         return len(page.choices) > 0
+
+
+class PerformanceHUD():
+    """
+    Overlays how long each section of the frame took and what was counted
+    during it, averaged over the frames the profiler keeps.
+    """
+
+    LOCATION = (4, 4)
+    FONT_FACE = 'monospace'
+    TEXT_SIZE = 10
+    TEXT_COLOR = (255, 255, 255)
+    BACKGROUND_COLOR = (0, 0, 0, 160)
+    MARGIN = 4
+    # How often, in milliseconds of profiled frames, the numbers are updated
+    REFRESH_INTERVAL = 250
+    fonts = FontCache()
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.font = self.fonts.get(self.FONT_FACE, self.TEXT_SIZE)
+        self.lines = []
+        self.refreshed_at = None
+        # The overlay is rendered into a surface that's kept from frame to
+        # frame, and only drawn from within its area
+        self.surface = None
+        self.area = None
+
+    def get_lines(self):
+        times, counts = self.profiler.get_averages()
+        frames = self.profiler.frames
+        lines = []
+        if len(frames) > 1:
+            span = (frames[-1][0] - frames[0][0]) / 1e6 / (len(frames) - 1)
+            lines.append('frame {:6.2f} ms  {:5.1f} fps'.format(span, 1000 / span if span else 0))
+        for name in sorted(times, key=times.get, reverse=True):
+            lines.append('{:<24}{:6.2f} ms'.format(name, times[name]))
+        for name in sorted(counts):
+            lines.append('{:<24}{:6.0f}'.format(name, counts[name]))
+        return lines
+
+    def refresh(self):
+        """Renders the overlay again, if its lines changed since it was last
+        rendered. Its surface is only replaced when it has to grow."""
+        lines = self.get_lines()
+        if lines == self.lines:
+            return
+        self.lines = lines
+        if not lines:
+            self.area = None
+            return
+        line_height = self.font.get_sized_height()
+        width = max(self.font.get_rect(line).width for line in lines)
+        self.area = pygame.Rect(
+            0, 0, width + 2 * self.MARGIN, line_height * len(lines) + 2 * self.MARGIN
+        )
+        if self.surface is None or not self.surface.get_rect().contains(self.area):
+            self.surface = pygame.Surface(self.area.size, flags=pygame.SRCALPHA)
+        self.surface.fill(self.BACKGROUND_COLOR, self.area)
+        for i, line in enumerate(lines):
+            self.font.render_to(
+                self.surface, (self.MARGIN, self.MARGIN + i * line_height), line,
+                fgcolor=self.TEXT_COLOR
+            )
+
+    @profiled('PerformanceHUD.draw')
+    def draw(self, display):
+        frames = self.profiler.frames
+        last_frame = frames[-1][0] if frames else None
+        if (
+            self.refreshed_at is None or last_frame is None or
+            last_frame - self.refreshed_at >= self.REFRESH_INTERVAL * 1e6
+        ):
+            self.refreshed_at = last_frame
+            self.refresh()
+        if self.area is not None:
+            display.blit(self.surface, self.LOCATION, self.area)
@@ -1,12 +1,13 @@
-import json
+import array, gc, hashlib, json, os, pygame, struct, threading
 
-from .gameobjects import GameObject, GameGroup
+from .gameobjects import GameObject
+from .graphics import write_baked_file
 from .utilities import get_asset_path, str_to_gameobject
 
 
 class Level():
     def __init__(self, gameobjects=[]):
-        self.gameobjects = GameGroup()
+        self.gameobjects = pygame.sprite.Group()
         for gameobject_kwargs in gameobjects:
             self.gameobjects.add(self._create_gameobject(**gameobject_kwargs))
 
@@ -25,10 +26,250 @@ class Level():
         return json
 
     @classmethod
-    def load_from_file(self, filename):
-        with open(get_asset_path(filename), 'r') as levelfile:
+    def load_from_file(self, filename, use_cache=True, progress=None):
+        """Loads a level from a JSON level file. Unless use_cache is False, the
+        level is loaded from a compiled copy kept next to the file, which is
+        made or refreshed first if needed. If given, progress is called with
+        the fraction of the level's objects built so far."""
+        path = get_asset_path(filename)
+        if use_cache:
+            return CompiledLevel.load_cached(path).build(progress)
+        with open(path, 'r') as levelfile:
             data = json.load(
                 levelfile,
                 object_hook=self._json_to_init_kwargs
             )
-        return Level(**data)
+        level = Level(**data)
+        if progress:
+            progress(1.0)
+        return level
+
+
+class CompiledLevel():
+    """
+    A compact binary form of a level file, which can be loaded without parsing
+    JSON or looking classes up once per object.
+
+    Objects are stored as a table of class names and packed arrays of class
+    IDs, coordinates and parent indices, with every object listed after its
+    parent. Compiled levels are cached next to the level file they come from,
+    and are recompiled when that file changes.
+    """
+
+    MAGIC = b'PYNL'
+    VERSION = 1
+    EXTENSION = '.lvlc'
+    # magic, version, coordinate typecode, source mtime in ns, source size,
+    # source SHA-1, number of classes, number of objects
+    HEADER = struct.Struct('<4sHcxqq20sII')
+    NAME_LENGTH = struct.Struct('<H')
+    SUPPORTED_KEYS = { 'class', 'location', 'children' }
+
+    def __init__(self, class_names, class_ids, xs, ys, parents):
+        self.class_names = class_names
+        self.class_ids = class_ids
+        self.xs = xs
+        self.ys = ys
+        self.parents = parents
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    @classmethod
+    def from_json_data(cls, data):
+        """Compiles the data of a level file, as parsed by json."""
+        class_names = []
+        class_lookup = dict()
+        class_ids = array.array('H')
+        locations = []
+        parents = array.array('i')
+
+        def add_objects(object_list, parent):
+            for object_data in object_list:
+                unsupported = set(object_data) - cls.SUPPORTED_KEYS
+                if unsupported:
+                    raise ValueError("Cannot compile level object keys: {}".format(
+                        ', '.join(sorted(unsupported))
+                    ))
+                name = object_data.get('class', GameObject.__name__)
+                if name not in class_lookup:
+                    class_lookup[name] = len(class_names)
+                    class_names.append(name)
+                index = len(class_ids)
+                class_ids.append(class_lookup[name])
+                locations.append(tuple(object_data.get('location', (0, 0))))
+                parents.append(parent)
+                add_objects(object_data.get('children', []), index)
+
+        add_objects(data.get('gameobjects', []), -1)
+        typecode = 'i'
+        if not all(type(coord) == int for location in locations for coord in location):
+            typecode = 'd'
+        xs = array.array(typecode, [location[0] for location in locations])
+        ys = array.array(typecode, [location[1] for location in locations])
+        return cls(class_names, class_ids, xs, ys, parents)
+
+    def to_bytes(self, source_mtime=0, source_size=0, source_hash=bytes(20)):
+        chunks = [self.HEADER.pack(
+            self.MAGIC, self.VERSION, self.xs.typecode.encode(),
+            source_mtime, source_size, source_hash,
+            len(self.class_names), len(self)
+        )]
+        for name in self.class_names:
+            encoded_name = name.encode('utf-8')
+            chunks.append(self.NAME_LENGTH.pack(len(encoded_name)))
+            chunks.append(encoded_name)
+        for table in (self.class_ids, self.xs, self.ys, self.parents):
+            chunks.append(table.tobytes())
+        return b''.join(chunks)
+
+    @classmethod
+    def read_header(cls, blob):
+        """Returns the header fields of a compiled level, or None if the blob
+        isn't a compiled level this version can read."""
+        if len(blob) < cls.HEADER.size:
+            return None
+        header = cls.HEADER.unpack_from(blob)
+        if header[0] != cls.MAGIC or header[1] != cls.VERSION:
+            return None
+        return header
+
+    @classmethod
+    def from_bytes(cls, blob):
+        header = cls.read_header(blob)
+        if header is None:
+            raise ValueError("Not a compiled level")
+        typecode = header[2].decode()
+        class_count, object_count = header[6], header[7]
+        position = cls.HEADER.size
+        class_names = []
+        for _ in range(class_count):
+            if position + cls.NAME_LENGTH.size > len(blob):
+                raise ValueError("Compiled level is truncated")
+            (length,) = cls.NAME_LENGTH.unpack_from(blob, position)
+            position += cls.NAME_LENGTH.size
+            class_names.append(blob[position:position + length].decode('utf-8'))
+            position += length
+        table_typecodes = ('H', typecode, typecode, 'i')
+        expected_size = position + object_count * sum(
+            array.array(table_typecode).itemsize for table_typecode in table_typecodes
+        )
+        if len(blob) != expected_size:
+            raise ValueError("Compiled level should be {} bytes long, not {}".format(
+                expected_size, len(blob)
+            ))
+        tables = []
+        for table_typecode in table_typecodes:
+            table = array.array(table_typecode)
+            end = position + object_count * table.itemsize
+            table.frombytes(blob[position:end])
+            tables.append(table)
+            position = end
+        return cls(class_names, *tables)
+
+    @classmethod
+    def load_cached(cls, path):
+        """Returns the compiled form of the level file at path, from the cache
+        next to it if that's still up to date with the file."""
+        cache_path = path + cls.EXTENSION
+        stat = os.stat(path)
+        try:
+            with open(cache_path, 'rb') as cachefile:
+                blob = cachefile.read()
+        except OSError:
+            blob = b''
+        header = cls.read_header(blob)
+        cached = None
+        if header is not None:
+            try:
+                cached = cls.from_bytes(blob)
+            except ValueError:
+                # A damaged cache is compiled again
+                header = None
+        if cached is not None and header[3:5] == (stat.st_mtime_ns, stat.st_size):
+            return cached
+
+        with open(path, 'rb') as levelfile:
+            source = levelfile.read()
+        if cached is not None and header[5] == hashlib.sha1(source).digest():
+            # The file was touched without changing, so only the recorded
+            # modification time needs refreshing
+            compiled = cached
+        else:
+            compiled = cls.from_json_data(json.loads(source))
+        try:
+            compiled.write_cache(path, stat, source)
+        except OSError:
+            # The cache is only an optimization, so an unwritable asset
+            # directory shouldn't stop the level from loading
+            pass
+        return compiled
+
+    def write_cache(self, path, stat, source):
+        """Writes the compiled level to the cache next to the level file at
+        path, recording the file's stat and contents."""
+        write_baked_file(path + self.EXTENSION, self.to_bytes(
+            stat.st_mtime_ns, stat.st_size, hashlib.sha1(source).digest()
+        ))
+
+    @classmethod
+    def is_up_to_date(cls, path):
+        """Whether the cache next to the level file at path is up to date."""
+        try:
+            with open(path + cls.EXTENSION, 'rb') as cachefile:
+                header = cls.read_header(cachefile.read(cls.HEADER.size))
+        except OSError:
+            return False
+        stat = os.stat(path)
+        return header is not None and header[3:5] == (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def bake(cls, path):
+        """Compiles the level file at path into the cache next to it, even if
+        the cache is up to date already."""
+        stat = os.stat(path)
+        with open(path, 'rb') as levelfile:
+            source = levelfile.read()
+        cls.from_json_data(json.loads(source)).write_cache(path, stat, source)
+
+    # How many objects to build between calls to the progress callback
+    PROGRESS_INTERVAL = 256
+
+    def build(self, progress=None):
+        """Creates a Level holding the objects the compiled level describes. If
+        given, progress is called with the fraction of objects built so far."""
+        klasses = [str_to_gameobject(name) for name in self.class_names]
+        gameobjects = []
+        top_level_gameobjects = []
+        # Creating this many objects in one go would otherwise set the garbage
+        # collector off over and over, without there being anything to collect.
+        # The collector is shared by every thread though, so it's only paused
+        # for builds on the main thread, which hold the game loop up anyway.
+        gc_was_enabled = gc.isenabled()
+        pause_gc = gc_was_enabled and threading.current_thread() is threading.main_thread()
+        if pause_gc:
+            gc.disable()
+        try:
+            for class_id, x, y, parent in zip(self.class_ids, self.xs, self.ys, self.parents):
+                gameobject = klasses[class_id](x, y)
+                gameobjects.append(gameobject)
+                if parent < 0:
+                    top_level_gameobjects.append(gameobject)
+                else:
+                    gameobjects[parent].children.add(gameobject)
+                if progress and len(gameobjects) % self.PROGRESS_INTERVAL == 0:
+                    progress(len(gameobjects) / len(self))
+        except BaseException:
+            # Such as when progress cancels the build. Children are already
+            # on their parents, which give up their assets too.
+            for gameobject in top_level_gameobjects:
+                gameobject.release_assets()
+            raise
+        finally:
+            if pause_gc:
+                gc.enable()
+        level = Level()
+        level.gameobjects.add(*top_level_gameobjects)
+        if progress:
+            progress(1.0)
+        return level
@@ -0,0 +1,93 @@
+from bisect import bisect_left, insort
+from itertools import chain
+
+
+class SortedList():
+    """
+    Keeps values in sorted order as they're added and removed, split into
+    short sorted lists so that adding or removing a value only shifts the
+    values of one of them, rather than every value after it.
+
+    Values are found by bisecting the largest value of each list, then the
+    list itself, so they must all compare distinctly from one another.
+    """
+
+    # How many values the lists hold, roughly; lists twice as long are split
+    LOAD = 512
+
+    def __init__(self, values=()):
+        self.lists = []
+        self.maxes = []
+        self.length = 0
+        self.update(values)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.lists)
+
+    def clear(self):
+        self.lists = []
+        self.maxes = []
+        self.length = 0
+
+    def update(self, values):
+        """Adds many values at once, sorting them in with everything else in
+        one go if there are many of them."""
+        values = list(values)
+        if len(values) * 8 < self.length:
+            for value in values:
+                self.add(value)
+            return
+        values.extend(self)
+        values.sort()
+        self.lists = [
+            values[start:start + self.LOAD]
+            for start in range(0, len(values), self.LOAD)
+        ]
+        self.maxes = [values_list[-1] for values_list in self.lists]
+        self.length = len(values)
+
+    def add(self, value):
+        if not self.lists:
+            self.lists.append([value])
+            self.maxes.append(value)
+            self.length = 1
+            return
+        index = bisect_left(self.maxes, value)
+        if index == len(self.maxes):
+            index -= 1
+            self.lists[index].append(value)
+            self.maxes[index] = value
+        else:
+            insort(self.lists[index], value)
+        self.length += 1
+        if len(self.lists[index]) > 2 * self.LOAD:
+            values_list = self.lists[index]
+            self.lists[index:index + 1] = [values_list[:self.LOAD], values_list[self.LOAD:]]
+            self.maxes[index:index + 1] = [values_list[self.LOAD - 1], values_list[-1]]
+
+    def remove(self, value):
+        """Removes a value, which must be in the list."""
+        index = bisect_left(self.maxes, value)
+        values_list = self.lists[index]
+        del values_list[bisect_left(values_list, value)]
+        self.length -= 1
+        if values_list:
+            self.maxes[index] = values_list[-1]
+        else:
+            del self.lists[index]
+            del self.maxes[index]
+
+    def irange(self, minimum):
+        """Iterates over the values from the first one that isn't smaller
+        than minimum on."""
+        index = bisect_left(self.maxes, minimum)
+        if index == len(self.lists):
+            return iter(())
+        first_list = self.lists[index]
+        return chain(
+            first_list[bisect_left(first_list, minimum):],
+            chain.from_iterable(self.lists[index + 1:])
+        )
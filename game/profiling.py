@@ -0,0 +1,107 @@
+import functools, json, os, threading
+
+from collections import defaultdict, deque
+from time import perf_counter_ns
+
+
+class Profiler():
+    """
+    Records how long named sections of each frame take, and counts things
+    such as blits, into ring buffers holding the last stretch of frames.
+
+    Recording is off by default. Sections are marked with the profiled
+    decorator and counts with count, both of which do nothing but check
+    whether the profiler is enabled while it isn't.
+    """
+
+    DEFAULT_CAPACITY = 65536
+    DEFAULT_FRAME_HISTORY = 120
+
+    def __init__(self, capacity=None, frame_history=None):
+        self.enabled = False
+        # (name, thread ID, start, end), in nanoseconds
+        self.events = deque(maxlen=capacity or self.DEFAULT_CAPACITY)
+        # (end of the frame, total time per section, counts) for each frame
+        self.frames = deque(maxlen=frame_history or self.DEFAULT_FRAME_HISTORY)
+        self.frame_times = defaultdict(int)
+        self.frame_counts = defaultdict(int)
+        self.origin = perf_counter_ns()
+
+    def record(self, name, start, end):
+        self.events.append((name, threading.get_ident(), start, end))
+        self.frame_times[name] += end - start
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.frame_counts[name] += amount
+
+    def end_frame(self):
+        """Closes off the counts and section times of the current frame."""
+        if not self.enabled:
+            return
+        self.frames.append((perf_counter_ns(), self.frame_times, self.frame_counts))
+        self.frame_times = defaultdict(int)
+        self.frame_counts = defaultdict(int)
+
+    def clear(self):
+        self.events.clear()
+        self.frames.clear()
+        self.frame_times = defaultdict(int)
+        self.frame_counts = defaultdict(int)
+
+    def get_averages(self, frames=None):
+        """Returns the average milliseconds per frame spent in each section and
+        the average of each count, over the given number of recent frames."""
+        recent = list(self.frames)[-(frames or len(self.frames)):]
+        times = defaultdict(float)
+        counts = defaultdict(float)
+        for _, frame_times, frame_counts in recent:
+            for name, duration in frame_times.items():
+                times[name] += duration / 1e6 / len(recent)
+            for name, amount in frame_counts.items():
+                counts[name] += amount / len(recent)
+        return dict(times), dict(counts)
+
+    def export_chrome_trace(self, path):
+        """Writes the recorded sections and counts as a trace-event file, which
+        can be opened in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        trace_events = [
+            {
+                'name': name, 'ph': 'X', 'pid': pid, 'tid': thread,
+                'ts': (start - self.origin) / 1000, 'dur': (end - start) / 1000
+            }
+            for name, thread, start, end in self.events
+        ]
+        for end, _, counts in self.frames:
+            for name, amount in counts.items():
+                trace_events.append({
+                    'name': name, 'ph': 'C', 'pid': pid,
+                    'ts': (end - self.origin) / 1000, 'args': { name: amount }
+                })
+        with open(path, 'w') as tracefile:
+            json.dump({ 'traceEvents': trace_events, 'displayTimeUnit': 'ms' }, tracefile)
+
+
+# Shared by everything that's instrumented
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decorates a function so that each call to it is recorded as a section
+    with the given name while the profiler is enabled. Even while it isn't,
+    the wrapper adds a call to each one, so only functions that run a few
+    times a frame, such as its phases, are decorated, never per-object
+    ones."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start, perf_counter_ns())
+        return wrapper
+    return decorate
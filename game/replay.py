@@ -0,0 +1,125 @@
+import pygame, struct
+
+
+class InputFrame():
+    """The input a single step was run with: how many milliseconds it
+    covered, the keys pressed during it, as (key, mod) pairs, and the scancodes
+    of the keys held down at the end of it."""
+
+    __slots__ = ('step_delta', 'keydowns', 'held_scancodes')
+
+    def __init__(self, step_delta, keydowns=(), held_scancodes=()):
+        self.step_delta = step_delta
+        self.keydowns = tuple(keydowns)
+        self.held_scancodes = tuple(held_scancodes)
+
+    def get_pressed_keys(self):
+        """Returns the held keys in the same form as pygame.key.get_pressed."""
+        pressed = [False] * InputRecording.KEY_COUNT
+        for scancode in self.held_scancodes:
+            pressed[scancode] = True
+        return pygame.key.ScancodeWrapper(pressed)
+
+
+class InputRecording():
+    """
+    The input of every step of a session, which can be fed back through a
+    GameState to play the session out again exactly as it went.
+
+    Recordings are saved as a short header followed by one record per step:
+    the step's length, the number of keydowns and of held keys, then each
+    keydown as a key and modifier and each held key as a scancode.
+    """
+
+    MAGIC = b'GINP'
+    VERSION = 1
+    HEADER = struct.Struct('<4sH')
+    FRAME = struct.Struct('<IBB')
+    KEYDOWN = struct.Struct('<iH')
+    SCANCODE = struct.Struct('<H')
+    # The number of scancodes pygame.key.get_pressed covers
+    KEY_COUNT = 512
+
+    def __init__(self, frames=None):
+        self.frames = frames or []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def record(self, step_delta, keydowns, pressed_keys):
+        """Adds a step, given the (key, mod) pairs pressed during it and the
+        held keys, as returned by pygame.key.get_pressed."""
+        held_scancodes = [scancode for scancode, held in enumerate(pressed_keys) if held]
+        self.frames.append(InputFrame(step_delta, keydowns, held_scancodes))
+
+    def get_duration(self):
+        """Returns how many milliseconds of game time the recording covers."""
+        return sum(frame.step_delta for frame in self.frames)
+
+    def to_bytes(self):
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION)]
+        for frame in self.frames:
+            chunks.append(self.FRAME.pack(
+                frame.step_delta, len(frame.keydowns), len(frame.held_scancodes)
+            ))
+            for key, mod in frame.keydowns:
+                chunks.append(self.KEYDOWN.pack(key, mod))
+            for scancode in frame.held_scancodes:
+                chunks.append(self.SCANCODE.pack(scancode))
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Input recording is truncated")
+        magic, version = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not an input recording")
+        if version != cls.VERSION:
+            raise ValueError("Unsupported input recording version: {}".format(version))
+        frames = []
+        offset = cls.HEADER.size
+        try:
+            while offset < len(data):
+                step_delta, keydown_count, held_count = cls.FRAME.unpack_from(data, offset)
+                offset += cls.FRAME.size
+                keydowns = []
+                for _ in range(keydown_count):
+                    keydowns.append(cls.KEYDOWN.unpack_from(data, offset))
+                    offset += cls.KEYDOWN.size
+                held_scancodes = []
+                for _ in range(held_count):
+                    held_scancodes.append(cls.SCANCODE.unpack_from(data, offset)[0])
+                    offset += cls.SCANCODE.size
+                frames.append(InputFrame(step_delta, keydowns, held_scancodes))
+        except struct.error:
+            raise ValueError("Input recording is truncated")
+        return cls(frames)
+
+    def save(self, path):
+        with open(path, 'wb') as recordingfile:
+            recordingfile.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as recordingfile:
+            return cls.from_bytes(recordingfile.read())
+
+
+class InputPlayback():
+    """Steps through the frames of a recording, one per GameState step."""
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.position = 0
+        self.frame = None
+
+    def finished(self):
+        return self.position >= len(self.recording.frames)
+
+    def next_frame(self):
+        if self.finished():
+            raise ValueError("Input recording has no frames left")
+        self.frame = self.recording.frames[self.position]
+        self.position += 1
+        return self.frame
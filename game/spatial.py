@@ -0,0 +1,116 @@
+from itertools import count
+
+from .profiling import profiler
+
+
+class SpatialHash():
+    """
+    Buckets objects into a uniform grid of square cells based on a world-space
+    rect, so that area queries only have to look at the objects near them
+    rather than at every object in the world.
+    """
+
+    DEFAULT_CELL_SIZE = 128
+
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size or self.DEFAULT_CELL_SIZE
+        self.cells = dict()
+        self.rects = dict()
+        self.cell_ranges = dict()
+        # remembers insertion order so that query results are deterministic
+        self.insertion_order = dict()
+        self._counter = count()
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, obj):
+        return obj in self.rects
+
+    def get_cell_range(self, rect):
+        """Returns the (left, top, right, bottom) cell coordinates, inclusive,
+        covered by the rect."""
+        size = self.cell_size
+        left = rect.left // size
+        top = rect.top // size
+        right = max(left, (rect.right - 1) // size)
+        bottom = max(top, (rect.bottom - 1) // size)
+        return (left, top, right, bottom)
+
+    def iter_cells(self, cell_range):
+        left, top, right, bottom = cell_range
+        for cell_y in range(top, bottom + 1):
+            for cell_x in range(left, right + 1):
+                yield (cell_x, cell_y)
+
+    def insert(self, obj, rect):
+        if obj in self.rects:
+            self.remove(obj)
+        cell_range = self.get_cell_range(rect)
+        for cell in self.iter_cells(cell_range):
+            if cell not in self.cells:
+                self.cells[cell] = set()
+            self.cells[cell].add(obj)
+        self.rects[obj] = rect.copy()
+        self.cell_ranges[obj] = cell_range
+        self.insertion_order[obj] = next(self._counter)
+
+    def remove(self, obj):
+        if obj not in self.rects:
+            return
+        for cell in self.iter_cells(self.cell_ranges[obj]):
+            bucket = self.cells[cell]
+            bucket.discard(obj)
+            if not bucket:
+                del self.cells[cell]
+        del self.rects[obj]
+        del self.cell_ranges[obj]
+        del self.insertion_order[obj]
+
+    def move(self, obj, rect):
+        """Updates the rect an object is indexed by. Only touches the grid if
+        the object actually crossed into different cells. Returns whether the
+        object's rect changed at all."""
+        if rect == self.rects[obj]:
+            return False
+        new_range = self.get_cell_range(rect)
+        old_range = self.cell_ranges[obj]
+        if new_range != old_range:
+            for cell in self.iter_cells(old_range):
+                bucket = self.cells[cell]
+                bucket.discard(obj)
+                if not bucket:
+                    del self.cells[cell]
+            for cell in self.iter_cells(new_range):
+                if cell not in self.cells:
+                    self.cells[cell] = set()
+                self.cells[cell].add(obj)
+            self.cell_ranges[obj] = new_range
+        self.rects[obj] = rect.copy()
+        return True
+
+    def get_rect(self, obj):
+        return self.rects[obj]
+
+    def candidates(self, rect):
+        """Returns the set of objects sharing a cell with the rect, in no
+        particular order. They may not actually overlap the rect."""
+        candidates = set()
+        for cell in self.iter_cells(self.get_cell_range(rect)):
+            bucket = self.cells.get(cell)
+            if bucket:
+                candidates.update(bucket)
+        return candidates
+
+    def query(self, rect):
+        """Returns every object sharing a cell with the rect, in the order they
+        were inserted. These are only candidates: they may not actually
+        overlap the rect."""
+        return sorted(self.candidates(rect), key=self.insertion_order.__getitem__)
+
+    def collide(self, rect):
+        """Returns every object whose indexed rect overlaps the rect, in the
+        order they were inserted."""
+        candidates = self.query(rect)
+        profiler.count('collision_tests', len(candidates))
+        return [obj for obj in candidates if self.rects[obj].colliderect(rect)]
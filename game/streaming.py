@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+from .utilities import str_to_gameobject
+
+
+class StreamedLevel():
+    """
+    A level whose objects are only built while they're near the camera.
+
+    The world is divided into square regions, and each top-level object, along
+    with its children, belongs to the region its location falls in. Objects
+    are kept in their compiled form until their region comes within
+    load_radius regions of the camera, and are let go again once their region
+    is more than unload_radius regions away. Keeping unload_radius larger than
+    load_radius means a camera moving back and forth along a region's edge
+    doesn't keep loading and unloading the same regions.
+
+    Objects of classes marked stream_persistent, like the player, are built
+    up front and never unloaded.
+    """
+
+    DEFAULT_REGION_SIZE = 1024
+    DEFAULT_LOAD_RADIUS = 1
+    DEFAULT_UNLOAD_RADIUS = 2
+
+    def __init__(self, compiled_level, region_size=None, load_radius=None, unload_radius=None):
+        self.compiled_level = compiled_level
+        self.region_size = region_size or self.DEFAULT_REGION_SIZE
+        self.load_radius = load_radius
+        if load_radius is None:
+            self.load_radius = self.DEFAULT_LOAD_RADIUS
+        self.unload_radius = unload_radius
+        if unload_radius is None:
+            self.unload_radius = self.DEFAULT_UNLOAD_RADIUS
+        if self.unload_radius < self.load_radius:
+            raise ValueError("Cannot unload regions closer than they're loaded.")
+
+        self.klasses = [str_to_gameobject(name) for name in compiled_level.class_names]
+        self.children = defaultdict(list)
+        self.region_objects = defaultdict(list)
+        self.persistent_objects = []
+        for index, parent in enumerate(compiled_level.parents):
+            if parent >= 0:
+                self.children[parent].append(index)
+            elif getattr(self.klasses[compiled_level.class_ids[index]], 'stream_persistent', False):
+                self.persistent_objects.append(index)
+            else:
+                region = (
+                    int(compiled_level.xs[index] // self.region_size),
+                    int(compiled_level.ys[index] // self.region_size)
+                )
+                self.region_objects[region].append(index)
+        # Maps each loaded region to the top-level objects built for it
+        self.loaded_regions = dict()
+
+    def build_object(self, index):
+        level = self.compiled_level
+        gameobject = self.klasses[level.class_ids[index]](level.xs[index], level.ys[index])
+        for child_index in self.children[index]:
+            gameobject.children.add(self.build_object(child_index))
+        return gameobject
+
+    def build_persistent_objects(self):
+        return [self.build_object(index) for index in self.persistent_objects]
+
+    def get_region_range(self, rect, radius):
+        """Returns the (left, top, right, bottom) regions, inclusive, within
+        radius regions of the rect."""
+        size = self.region_size
+        return (
+            int(rect.left // size) - radius,
+            int(rect.top // size) - radius,
+            int((rect.right - 1) // size) + radius,
+            int((rect.bottom - 1) // size) + radius
+        )
+
+    def update(self, camera):
+        """Loads the regions near the camera's world-space rect and unloads the
+        ones far from it. Returns the objects that were built and the objects
+        that were let go."""
+        left, top, right, bottom = self.get_region_range(camera, self.unload_radius)
+        unloaded = []
+        for region in list(self.loaded_regions):
+            if not (left <= region[0] <= right and top <= region[1] <= bottom):
+                unloaded.extend(self.loaded_regions.pop(region))
+
+        left, top, right, bottom = self.get_region_range(camera, self.load_radius)
+        loaded = []
+        for region_y in range(top, bottom + 1):
+            for region_x in range(left, right + 1):
+                region = (region_x, region_y)
+                if region in self.loaded_regions:
+                    continue
+                gameobjects = [
+                    self.build_object(index)
+                    for index in self.region_objects.get(region, [])
+                ]
+                self.loaded_regions[region] = gameobjects
+                loaded.extend(gameobjects)
+        return loaded, unloaded